@@ -0,0 +1,114 @@
+"""Кеширование сериализованных рецептов.
+
+Каждый набор данных, от которого зависит ответ API, имеет версию —
+момент последнего изменения в наносекундах. Версии входят в ключи кеша,
+поэтому для инвалидации достаточно сдвинуть версию: старые записи больше
+не будут найдены и со временем вытеснятся из кеша.
+
+Версии лежат в таблице DataVersion, общей для всех процессов, поэтому
+изменения, сделанные управляющими командами в других контейнерах, видны
+gunicorn; сами данные кешируются в памяти процесса. Чтение версий — один
+запрос по уникальному индексу, сдвиг — один INSERT ... ON CONFLICT.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from recept.models import DataVersion, Tag
+
+
+RECIPE_FRAGMENT_KEY = 'recipe-fragment:{origin}:{pk}:{versions}'
+TAG_IDS_KEY = 'tag-ids:{version}'
+EPOCH = 'epoch'
+
+
+def get_versions(names):
+    """Вернуть версии наборов данных по их именам.
+
+    Версия, которой нет в таблице, ещё ни разу не сдвигалась и равна общей
+    начальной версии; поэтому чтение не записывает строку на каждый новый
+    рецепт или пользователя.
+    """
+    names = set(names)
+    found = dict(
+        DataVersion.objects.filter(name__in=[*names, EPOCH])
+        .values_list('name', 'value')
+    )
+    epoch = found.get(EPOCH)
+    if epoch is None:
+        # Таблица версий пуста или очищена: всё, что было закешировано
+        # раньше, считается устаревшим.
+        epoch = DataVersion.objects.get_or_create(
+            name=EPOCH, defaults={'value': time.time_ns()})[0].value
+    return {name: found.get(name, epoch) for name in names}
+
+
+def bump_versions(*names):
+    """Отметить наборы данных как изменённые.
+
+    Версия сдвигается после фиксации транзакции: иначе читатель, успевший
+    между сдвигом и фиксацией, закешировал бы старые данные под новой
+    версией.
+    """
+    def bump():
+        version = time.time_ns()
+        DataVersion.objects.bulk_create(
+            [DataVersion(name=name, value=version) for name in set(names)],
+            update_conflicts=True,
+            unique_fields=['name'],
+            update_fields=['value'],
+        )
+    transaction.on_commit(bump)
+
+
+def drop_versions(*names):
+    """Удалить версии наборов данных, которых больше нет.
+
+    Годится только для удалённых объектов: их ключи больше не
+    запрашиваются, а первичные ключи не переиспользуются.
+    """
+    transaction.on_commit(
+        lambda: DataVersion.objects.filter(name__in=names).delete())
+
+
+def get_recipe_fragment_keys(recipes, request):
+    """Ключи кеша общей для всех пользователей части рецептов."""
+    names = {'tags', 'ingredients'}
+    for recipe in recipes:
+        names.update((f'recipe:{recipe.pk}', f'user:{recipe.author_id}'))
+    versions = get_versions(names)
+    origin = (
+        f'{request.scheme}://{request.get_host()}' if request else '')
+    return {
+        recipe.pk: RECIPE_FRAGMENT_KEY.format(
+            origin=origin,
+            pk=recipe.pk,
+            versions='.'.join(str(version) for version in (
+                versions[f'recipe:{recipe.pk}'],
+                versions[f'user:{recipe.author_id}'],
+                versions['tags'],
+                versions['ingredients'],
+            )),
+        )
+        for recipe in recipes
+    }
+
+
+def get_recipe_fragments(keys):
+    return cache.get_many(keys)
+
+
+def set_recipe_fragments(fragments):
+    cache.set_many(fragments, timeout=settings.RECIPE_FRAGMENT_TIMEOUT)
+
+
+def get_tag_ids_by_slug():
+    """Идентификаторы тегов по слагам, закешированные до изменения тегов."""
+    key = TAG_IDS_KEY.format(version=get_versions(['tags'])['tags'])
+    tag_ids = cache.get(key)
+    if tag_ids is None:
+        tag_ids = dict(Tag.objects.values_list('slug', 'id'))
+        cache.set(key, tag_ids, timeout=None)
+    return tag_ids
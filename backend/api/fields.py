@@ -0,0 +1,142 @@
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from drf_extra_fields.fields import Base64ImageField
+from PIL import Image
+from rest_framework import serializers
+from rest_framework.relations import MANY_RELATION_KWARGS
+
+
+def get_objects_in_bulk(queryset, pks):
+    """Получить объекты по списку id одним запросом.
+
+    Возвращает объекты в порядке ``pks``; о всех несуществующих id
+    сообщает одной ошибкой.
+    """
+    objects = queryset.in_bulk(set(pks))
+    missing = sorted({pk for pk in pks if pk not in objects})
+    if missing:
+        raise serializers.ValidationError(
+            'Объекты с id {} не существуют.'.format(
+                ', '.join(map(str, missing))))
+    return [objects[pk] for pk in pks]
+
+
+class BulkManyRelatedField(serializers.ManyRelatedField):
+    def to_internal_value(self, data):
+        if isinstance(data, str) or not hasattr(data, '__iter__'):
+            self.fail('not_a_list', input_type=type(data).__name__)
+        if not self.allow_empty and len(data) == 0:
+            self.fail('empty')
+        return self.child_relation.to_internal_value_many(data)
+
+
+class BulkPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """Первичный ключ, который при many=True проверяется одним запросом."""
+
+    @classmethod
+    def many_init(cls, *args, **kwargs):
+        list_kwargs = {'child_relation': cls(*args, **kwargs)}
+        for key in kwargs:
+            if key in MANY_RELATION_KWARGS:
+                list_kwargs[key] = kwargs[key]
+        return BulkManyRelatedField(**list_kwargs)
+
+    def to_pk(self, data):
+        if self.pk_field is not None:
+            data = self.pk_field.to_internal_value(data)
+        try:
+            if isinstance(data, bool):
+                raise TypeError
+            return int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+    def to_internal_value_many(self, data):
+        return get_objects_in_bulk(
+            self.get_queryset(), [self.to_pk(item) for item in data])
+
+
+class ImageSrcsetField(serializers.Field):
+    """Ссылки на изображение для атрибутов src и srcset.
+
+    ``default`` — оригинал; пока уменьшенные копии не готовы,
+    возвращается только он.
+    """
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def build_url(self, storage, name):
+        url = storage.url(name)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def to_representation(self, instance):
+        image = instance.image
+        if not image:
+            return None
+        srcset = {'default': self.build_url(image.storage, image.name)}
+        if instance.image_derivatives_ready:
+            formats = instance.image_derivatives['formats']
+            for image_format, variants in formats.items():
+                srcset[f'image/{image_format}'] = ', '.join(
+                    '{} {}w'.format(
+                        self.build_url(image.storage, variant['name']),
+                        variant['width'],
+                    )
+                    for variant in variants
+                )
+        return srcset
+
+
+class LimitedImageField(serializers.ImageField):
+    """Изображение с ограничением размера файла и разрешения.
+
+    Разрешение читается из заголовка файла, поэтому слишком большие
+    картинки отклоняются до полного декодирования.
+    """
+
+    default_error_messages = {
+        'file_too_large': 'Размер файла не должен превышать {max_size} МБ.',
+        'too_many_pixels': (
+            'Разрешение изображения не должно превышать {max_pixels} '
+            'мегапикселей.'),
+    }
+
+    def check_file_size(self, size):
+        if size > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.fail('file_too_large',
+                      max_size=settings.IMAGE_UPLOAD_MAX_SIZE // 2 ** 20)
+
+    def to_internal_value(self, data):
+        self.check_file_size(data.size)
+        try:
+            with Image.open(data) as image:
+                width, height = image.size
+        except (OSError, ValueError, Image.DecompressionBombError):
+            self.fail('invalid_image')
+        finally:
+            data.seek(0)
+        if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+            self.fail('too_many_pixels',
+                      max_pixels=settings.IMAGE_UPLOAD_MAX_PIXELS // 10 ** 6)
+        return super().to_internal_value(data)
+
+
+class ImageUploadField(Base64ImageField, LimitedImageField):
+    """Изображение файлом из multipart/form-data или строкой base64.
+
+    Файл из формы передаётся как есть: Django уже сохранил его
+    во временный файл, не держа в памяти.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            return LimitedImageField.to_internal_value(self, data)
+        if isinstance(data, str):
+            # Размер файла известен ещё до декодирования base64.
+            encoded = data.split(';base64,')[-1]
+            self.check_file_size(len(encoded) * 3 // 4)
+        return super().to_internal_value(data)
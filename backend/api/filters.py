@@ -1,25 +1,82 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import Exists, F, OuterRef
 from django_filters import rest_framework as filters
 
-from recept.models import Ingredient, Recipe
+from api.cache import get_tag_ids_by_slug
+from recept.models import Favorite, Ingredient, Recipe, ShoppingCart
+
+
+RECIPE_ORDERINGS = {
+    'popular': ('-popularity_score', '-id'),
+    'trending': ('-trending_score', '-id'),
+}
+
+
+def get_tag_choices():
+    return [(slug, slug) for slug in get_tag_ids_by_slug()]
 
 
 class RecipeFilter(filters.FilterSet):
+    """Фильтры рецептов.
+
+    Все фильтры по связанным таблицам строятся на подзапросах EXISTS,
+    поэтому не размножают строки рецептов и не требуют DISTINCT.
+    """
+
+    q = filters.CharFilter(method='filter_search')
     author = filters.NumberFilter(field_name='author__id')
-    tags = filters.AllValuesMultipleFilter(field_name='tags__slug')
+    tags = filters.MultipleChoiceFilter(
+        choices=get_tag_choices, method='filter_tags')
     is_favorited = filters.BooleanFilter(method='filter_is_favorited')
     is_in_shopping_cart = filters.BooleanFilter(
         method='filter_in_shopping_cart')
+    ordering = filters.ChoiceFilter(
+        choices=[(name, name) for name in RECIPE_ORDERINGS],
+        method='filter_ordering')
 
     class Meta:
         model = Recipe
-        fields = ['author', 'tags', 'is_favorited', 'is_in_shopping_cart']
+        fields = [
+            'q', 'author', 'tags', 'is_favorited', 'is_in_shopping_cart',
+            'ordering']
+
+    def filter_search(self, queryset, name, value):
+        """Полнотекстовый поиск по названию и описанию.
+
+        Вектор хранится в рецепте и обновляется триггером, поиск идёт
+        по GIN-индексу; результаты упорядочены по релевантности.
+        """
+
+        query = SearchQuery(value, config='russian', search_type='websearch')
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=SearchRank(F('search_vector'), query),
+        ).order_by('-search_rank', '-id')
+
+    def filter_ordering(self, queryset, name, value):
+        """Сортировка по рейтингу из update_recipe_scores.
+
+        Рейтинги хранятся в рецепте и покрыты индексами (рейтинг, id),
+        поэтому страница стоит столько же, сколько при сортировке по id.
+        """
+
+        return queryset.order_by(*RECIPE_ORDERINGS[value])
+
+    def filter_tags(self, queryset, name, value):
+        """Фильтр по любому из переданных слагов тегов."""
+
+        tag_ids = get_tag_ids_by_slug()
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'),
+            tag_id__in=[tag_ids[slug] for slug in value if slug in tag_ids],
+        )))
 
     def filter_is_favorited(self, queryset, name, value):
         """Фильтр для избранного."""
 
         user = self.request.user
         if value and user.is_authenticated:
-            return queryset.filter(favorited_by__user=user)
+            return queryset.filter(Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))))
         return queryset
 
     def filter_in_shopping_cart(self, queryset, name, value):
@@ -27,7 +84,8 @@ class RecipeFilter(filters.FilterSet):
 
         user = self.request.user
         if value and user.is_authenticated:
-            return queryset.filter(shopping_cart__user=user)
+            return queryset.filter(Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk'))))
         return queryset
 
 
@@ -0,0 +1,41 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.search import ingredient_index
+from recept.models import Ingredient
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает поиск ингредиентов по префиксу в памяти и в базе.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--repeat', type=int, default=3,
+            help='Сколько раз прогнать каждый префикс.',
+        )
+
+    def handle(self, *args, **options):
+        names = Ingredient.objects.values_list('name', flat=True)
+        prefixes = sorted({
+            name[:length] for name in names for length in (1, 2, 3)})
+        if not prefixes:
+            self.stdout.write('Нет ингредиентов для замера.')
+            return
+        ingredient_index.refresh()
+        lookups = (
+            ('память', ingredient_index.search_prefix),
+            ('база', lambda prefix: list(
+                Ingredient.objects.filter(name__istartswith=prefix))),
+        )
+        for title, lookup in lookups:
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                for prefix in prefixes:
+                    lookup(prefix)
+            elapsed = time.perf_counter() - started
+            count = len(prefixes) * options['repeat']
+            self.stdout.write(
+                f'{title}: {count} запросов за {elapsed:.3f} с, '
+                f'{elapsed / count * 1000:.3f} мс на запрос'
+            )
@@ -0,0 +1,72 @@
+import hashlib
+
+from django.utils.cache import (
+    get_conditional_response,
+    patch_cache_control,
+    patch_vary_headers,
+)
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from api.cache import get_versions
+
+
+class ConditionalGetMixin:
+    """Условные GET-запросы для списка и детальной страницы.
+
+    ETag и Last-Modified строятся из версий наборов данных, поэтому
+    совпавший If-None-Match получает 304 без обращения к сериализатору.
+    Если ответ зависит от пользователя, его версия и идентификатор
+    тоже входят в валидатор. Прочитанные версии остаются в ``versions``,
+    чтобы обработчик запроса не запрашивал их повторно.
+    """
+
+    version_names = ()
+    viewer_dependent = False
+    versions = None
+
+    def get_version_names(self, instance=None):
+        return list(self.version_names)
+
+    def get_validators(self, names):
+        user = self.request.user
+        if self.viewer_dependent and user.is_authenticated:
+            names = [*names, f'viewer:{user.pk}']
+        versions = self.versions = get_versions(names)
+        source = '|'.join((
+            self.request.get_full_path(),
+            self.request.accepted_renderer.format,
+            str(user.pk) if self.viewer_dependent else '',
+            *(f'{name}={versions[name]}' for name in sorted(versions)),
+        ))
+        etag = quote_etag(hashlib.md5(source.encode()).hexdigest())
+        last_modified = max(versions.values()) // 10 ** 9
+        return etag, last_modified
+
+    def conditional_response(self, names, get_response):
+        etag, last_modified = self.get_validators(names)
+        response = get_conditional_response(
+            self.request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = get_response()
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(
+            response, no_cache=True, private=self.viewer_dependent)
+        if self.viewer_dependent:
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+    def list(self, request, *args, **kwargs):
+        parent = super()
+        return self.conditional_response(
+            self.get_version_names(),
+            lambda: parent.list(request, *args, **kwargs),
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return self.conditional_response(
+            self.get_version_names(instance),
+            lambda: Response(self.get_serializer(instance).data),
+        )
@@ -1,5 +1,49 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import CursorPagination, PageNumberPagination
 
 
 class LimitPageNumberPagination(PageNumberPagination):
     page_size_query_param = 'limit'
+
+
+class LimitCursorPagination(CursorPagination):
+    page_size_query_param = 'limit'
+    ordering = '-id'
+
+
+class LimitPageNumberOrCursorPagination(LimitPageNumberPagination):
+    """Постраничная пагинация с необязательным курсорным режимом.
+
+    Курсорный режим включается параметром cursor (в том числе пустым):
+    страница выбирается по ключу сортировки без COUNT(*) и OFFSET,
+    а в ответе вместо count передаются ссылки next и previous
+    с непрозрачным курсором.
+    """
+
+    cursor_query_param = 'cursor'
+    cursor_ordering = '-id'
+    cursor_paginator = None
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        self.cursor_paginator = LimitCursorPagination()
+        self.cursor_paginator.ordering = self.cursor_ordering
+        page = self.cursor_paginator.paginate_queryset(
+            queryset, request, view)
+        self.display_page_controls = (
+            self.cursor_paginator.display_page_controls)
+        return page
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is None:
+            return super().get_paginated_response(data)
+        return self.cursor_paginator.get_paginated_response(data)
+
+    def to_html(self):
+        if self.cursor_paginator is None:
+            return super().to_html()
+        return self.cursor_paginator.to_html()
+
+
+class SubscriptionPagination(LimitPageNumberOrCursorPagination):
+    cursor_ordering = 'username'
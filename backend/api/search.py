@@ -0,0 +1,304 @@
+"""Поисковые индексы в памяти процесса."""
+import bisect
+import functools
+import heapq
+import re
+import threading
+from collections import Counter, defaultdict
+
+import numpy as np
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import connection
+from django.db.models import Case, IntegerField, Q, Value, When
+
+from api.cache import get_versions
+from recept.models import Ingredient, RecipeIngredient
+
+
+# Порог и разбиение на триграммы повторяют поведение pg_trgm.
+TRIGRAM_SIMILARITY_THRESHOLD = 0.3
+# Сколько кандидатов с наибольшим числом общих триграмм оценивается
+# при нечётком поиске; ограничивает время ответа на любой запрос.
+# При равном числе общих триграмм берутся первые по алфавиту.
+MAX_TRIGRAM_CANDIDATES = 200
+
+WORD_PATTERN = re.compile(r'\w+')
+
+
+def get_trigrams(text):
+    """Триграммы слов строки, дополненных пробелами, как в pg_trgm."""
+    trigrams = set()
+    for word in WORD_PATTERN.findall(text.casefold()):
+        padded = f'  {word} '
+        trigrams.update(
+            padded[index:index + 3] for index in range(len(padded) - 2))
+    return trigrams
+
+
+class IngredientIndex:
+    """Ингредиенты, отсортированные по названию в нижнем регистре.
+
+    Поиск по префиксу сводится к двум бинарным поискам по списку ключей,
+    а для поиска по подстроке и с опечатками хранится инвертированный
+    индекс триграмм. Индекс перестраивается, когда меняется версия
+    набора ингредиентов.
+    """
+
+    def __init__(self):
+        self.version = None
+        self.entries = ([], [], {}, [])
+        self.lock = threading.Lock()
+
+    def build(self):
+        ingredients = sorted(
+            Ingredient.objects.all(),
+            key=lambda ingredient: ingredient.name.casefold(),
+        )
+        keys = [ingredient.name.casefold() for ingredient in ingredients]
+        postings = {}
+        sizes = []
+        for position, key in enumerate(keys):
+            trigrams = get_trigrams(key)
+            sizes.append(len(trigrams))
+            for trigram in trigrams:
+                postings.setdefault(trigram, []).append(position)
+        self.entries = (keys, ingredients, postings, sizes)
+
+    def refresh(self, version=None):
+        """Перестроить индекс, если версия ингредиентов сдвинулась.
+
+        Версию, уже прочитанную обработчиком запроса, можно передать,
+        чтобы не запрашивать её ещё раз.
+        """
+        if version is None:
+            version = get_versions(['ingredients'])['ingredients']
+        if version == self.version:
+            return
+        with self.lock:
+            if version != self.version:
+                self.build()
+                self.version = version
+
+    def get_prefix_range(self, keys, prefix):
+        start = bisect.bisect_left(keys, prefix)
+        return start, bisect.bisect_left(keys, prefix + chr(0x10FFFF), start)
+
+    def search_prefix(self, prefix, version=None):
+        self.refresh(version)
+        keys, ingredients, _, _ = self.entries
+        start, end = self.get_prefix_range(keys, prefix.casefold())
+        return ingredients[start:end]
+
+    def search(self, query, limit, version=None):
+        """Ранжированный поиск: префикс, подстрока, похожие названия."""
+        self.refresh(version)
+        keys, ingredients, postings, sizes = self.entries
+        query = query.casefold().strip()
+        if not query:
+            return []
+        start, end = self.get_prefix_range(keys, query)
+        found = list(range(start, min(end, start + limit)))
+        if len(found) < limit:
+            # Подстроку ищем полным проходом по ключам: их несколько
+            # тысяч, а отбор по триграммам терял бы часть совпадений.
+            found.extend(sorted(
+                (position for position, key in enumerate(keys)
+                 if query in key and not start <= position < end),
+                key=lambda position: (
+                    keys[position].index(query), keys[position]),
+            ))
+        if len(found) < limit:
+            query_trigrams = get_trigrams(query)
+            shared = Counter()
+            for trigram in query_trigrams:
+                shared.update(postings.get(trigram, ()))
+            candidates = heapq.nsmallest(
+                MAX_TRIGRAM_CANDIDATES,
+                (position for position in shared
+                 if query not in keys[position]),
+                key=lambda position: (-shared[position], position),
+            )
+            similarity = {
+                position: shared[position] / (
+                    len(query_trigrams) + sizes[position] - shared[position])
+                for position in candidates
+            }
+            found.extend(sorted(
+                (position for position, score in similarity.items()
+                 if score >= TRIGRAM_SIMILARITY_THRESHOLD),
+                key=lambda position: (-similarity[position], keys[position]),
+            ))
+        return [ingredients[position] for position in found[:limit]]
+
+
+@functools.cache
+def has_trigram_extension():
+    """Установлено ли pg_trgm; проверяется один раз на процесс.
+
+    Миграция 0008 пропускает расширение, если его нет в сборке
+    PostgreSQL.
+    """
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        return cursor.fetchone() is not None
+
+
+def search_ingredients_in_db(queryset, query, limit):
+    """Тот же ранжированный поиск средствами pg_trgm.
+
+    Без pg_trgm остаются префикс и подстрока, без похожих названий.
+    """
+    match_rank = Case(
+        When(name__istartswith=query, then=Value(0)),
+        When(name__icontains=query, then=Value(1)),
+        default=Value(2),
+        output_field=IntegerField(),
+    )
+    if not has_trigram_extension():
+        return queryset.filter(name__icontains=query).annotate(
+            match_rank=match_rank,
+        ).order_by('match_rank', 'name')[:limit]
+    return queryset.filter(
+        Q(name__icontains=query) | Q(name__trigram_similar=query)
+    ).annotate(
+        match_rank=match_rank,
+        similarity=TrigramSimilarity('name', query),
+    ).order_by('match_rank', '-similarity', 'name')[:limit]
+
+
+class RecipeIngredientIndex:
+    """Инвертированный индекс «ингредиент → рецепты».
+
+    Для каждого ингредиента хранится отсортированный массив позиций
+    рецептов, для каждой позиции — id рецепта и число его ингредиентов.
+    Совпадения по набору ингредиентов считаются одним np.bincount.
+    Изменение состава любого рецепта в любом процессе сдвигает общую
+    версию recipe-ingredients; увидев её, индекс сверяется с базой и
+    обновляет только изменившиеся списки. Полностью индекс
+    перестраивается, когда меняется версия набора ингредиентов.
+    """
+
+    def __init__(self):
+        self.versions = None
+        self.lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self.positions = {}
+        self.recipe_ids = np.empty(0, dtype=np.int64)
+        self.sizes = np.empty(0, dtype=np.int32)
+        self.recipe_ingredients = []
+        self.postings = {}
+
+    def build(self):
+        self.clear()
+        self.update()
+
+    def update(self, recipe_ids=None):
+        """Переиндексировать рецепты по текущему составу в базе.
+
+        Без аргумента сверяются все рецепты, включая удалённые.
+        """
+        links = RecipeIngredient.objects.all()
+        if recipe_ids is not None:
+            links = links.filter(recipe_id__in=recipe_ids)
+        current = defaultdict(set)
+        for recipe_id, ingredient_id in links.values_list(
+                'recipe_id', 'ingredient_id').iterator():
+            current[recipe_id].add(ingredient_id)
+        recipe_ids = set(
+            self.positions if recipe_ids is None else recipe_ids
+        ) | current.keys()
+        added = defaultdict(list)
+        removed = defaultdict(list)
+        new_ids = []
+        new_sizes = []
+        for recipe_id in recipe_ids:
+            ingredients = current.get(recipe_id, set())
+            position = self.positions.get(recipe_id)
+            if position is None:
+                if not ingredients:
+                    continue
+                position = len(self.recipe_ingredients)
+                self.positions[recipe_id] = position
+                self.recipe_ingredients.append(set())
+                new_ids.append(recipe_id)
+                new_sizes.append(0)
+            previous = self.recipe_ingredients[position]
+            for ingredient_id in ingredients - previous:
+                added[ingredient_id].append(position)
+            for ingredient_id in previous - ingredients:
+                removed[ingredient_id].append(position)
+            self.recipe_ingredients[position] = ingredients
+        if new_ids:
+            self.recipe_ids = np.concatenate(
+                [self.recipe_ids, np.array(new_ids, dtype=np.int64)])
+            self.sizes = np.concatenate(
+                [self.sizes, np.array(new_sizes, dtype=np.int32)])
+        for recipe_id in recipe_ids:
+            position = self.positions.get(recipe_id)
+            if position is not None:
+                self.sizes[position] = len(self.recipe_ingredients[position])
+        for ingredient_id in added.keys() | removed.keys():
+            posting = self.postings.get(
+                ingredient_id, np.empty(0, dtype=np.int32))
+            if removed[ingredient_id]:
+                posting = np.setdiff1d(
+                    posting, removed[ingredient_id], assume_unique=True)
+            if added[ingredient_id]:
+                posting = np.union1d(
+                    posting, np.array(added[ingredient_id], dtype=np.int32))
+            if posting.size:
+                self.postings[ingredient_id] = posting.astype(np.int32)
+            else:
+                self.postings.pop(ingredient_id, None)
+
+    def refresh(self):
+        versions = get_versions(['ingredients', 'recipe-ingredients'])
+        if versions == self.versions:
+            return
+        if self.versions is None or (
+                versions['ingredients'] != self.versions['ingredients']):
+            self.build()
+        else:
+            self.update()
+        self.versions = versions
+
+    def search(self, ingredient_ids, full=False):
+        """Рецепты, в которых есть хотя бы один из ингредиентов.
+
+        Возвращает тройки (id рецепта, найдено ингредиентов, всего
+        ингредиентов): сначала по числу найденных, затем по доле, затем
+        новые. При full=True — только рецепты, полностью покрытые
+        переданным набором.
+        """
+        with self.lock:
+            self.refresh()
+            postings = [
+                self.postings[pk] for pk in set(ingredient_ids)
+                if pk in self.postings
+            ]
+            if not postings:
+                return []
+            counts = np.bincount(
+                np.concatenate(postings), minlength=self.sizes.size)
+            matched = np.flatnonzero(counts)
+            sizes = self.sizes[matched]
+            counts = counts[matched]
+            if full:
+                covered = counts == sizes
+                matched, sizes, counts = (
+                    matched[covered], sizes[covered], counts[covered])
+            recipe_ids = self.recipe_ids[matched]
+            order = np.lexsort((-recipe_ids, -(counts / sizes), -counts))
+            return list(zip(
+                recipe_ids[order].tolist(),
+                counts[order].tolist(),
+                sizes[order].tolist(),
+            ))
+
+
+ingredient_index = IngredientIndex()
+recipe_ingredient_index = RecipeIngredientIndex()
@@ -1,16 +1,27 @@
+from collections import defaultdict
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from drf_extra_fields.fields import Base64ImageField
+from django.db import transaction
+from django.db.models import F, Prefetch, Window, prefetch_related_objects
+from django.db.models.functions import RowNumber
+from django.db.models.manager import BaseManager
 from rest_framework import serializers
 
-from api.serializers.users import UserFullSerializer
-from recept.models import (
-    Favorite,
-    Ingredient,
-    Recipe,
-    RecipeIngredient,
-    ShoppingCart,
-    Tag,
+from api.cache import (
+    get_recipe_fragment_keys,
+    get_recipe_fragments,
+    set_recipe_fragments,
+)
+from api.fields import (
+    BulkPrimaryKeyRelatedField,
+    ImageSrcsetField,
+    ImageUploadField,
+    get_objects_in_bulk,
 )
+from api.serializers.users import AuthorSerializer, get_avatar_url
+from recept.models import Favorite, Ingredient, Recipe, RecipeIngredient, Tag
+from recept.signals import recipe_ingredients_changed
 from users.models import Follow
 
 
@@ -41,12 +52,25 @@ class RecipeIngredientReadSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'measurement_unit', 'amount']
 
 
+class RecipeIngredientWriteListSerializer(serializers.ListSerializer):
+    def to_internal_value(self, data):
+        items = super().to_internal_value(data)
+        ingredients = get_objects_in_bulk(
+            Ingredient.objects.all(), [item['id'] for item in items])
+        for item, ingredient in zip(items, ingredients):
+            item['id'] = ingredient
+        return items
+
+
 class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(queryset=Ingredient.objects.all())
+    # Ингредиенты всего списка ищутся одним запросом
+    # в RecipeIngredientWriteListSerializer.
+    id = serializers.IntegerField(min_value=1)
 
     class Meta:
         model = RecipeIngredient
         fields = ['id', 'amount']
+        list_serializer_class = RecipeIngredientWriteListSerializer
 
     def validate_amount(self, value):
         if value < 1:
@@ -55,43 +79,116 @@ class RecipeIngredientWriteSerializer(serializers.ModelSerializer):
         return value
 
 
+class RecipeReadListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        recipes = data.all() if isinstance(data, BaseManager) else data
+        return self.child.to_representation_many(list(recipes))
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
-    author = UserFullSerializer(read_only=True)
+    """Рецепт для чтения.
+
+    Общая для всех пользователей часть рецепта берётся из кеша, а поля,
+    зависящие от текущего пользователя, добавляются при каждом ответе.
+    """
+
+    author = AuthorSerializer(read_only=True)
     tags = TagSerializer(many=True, read_only=True)
     ingredients = serializers.SerializerMethodField()
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
-    image = Base64ImageField(allow_null=True)
+    image = serializers.ImageField(read_only=True)
+    image_srcset = ImageSrcsetField()
 
     class Meta:
         model = Recipe
         fields = [
-            'id', 'author', 'ingredients', 'tags', 'image',
+            'id', 'author', 'ingredients', 'tags', 'image', 'image_srcset',
             'name', 'text', 'cooking_time',
             'is_favorited', 'is_in_shopping_cart'
         ]
+        list_serializer_class = RecipeReadListSerializer
+
+    viewer_fields = ('is_favorited', 'is_in_shopping_cart')
+
+    def to_representation(self, instance):
+        return self.to_representation_many([instance])[0]
+
+    def to_representation_many(self, recipes):
+        request = self.context.get('request')
+        if request and request.user.is_authenticated:
+            # Подписки на авторов всей страницы — одним запросом.
+            self.fields['author'].get_subscribed_ids(
+                request.user, {recipe.author_id for recipe in recipes})
+        keys = get_recipe_fragment_keys(recipes, request)
+        fragments = get_recipe_fragments(keys.values())
+        missing = [
+            recipe for recipe in recipes if keys[recipe.pk] not in fragments]
+        if missing:
+            prefetch_related_objects(missing, *self.get_prefetch_lookups())
+            built = {
+                keys[recipe.pk]: self.build_fragment(recipe)
+                for recipe in missing
+            }
+            set_recipe_fragments(built)
+            fragments.update(built)
+        return [
+            self.add_viewer_fields(fragments[keys[recipe.pk]], recipe)
+            for recipe in recipes
+        ]
+
+    def get_prefetch_lookups(self):
+        return [
+            'tags',
+            Prefetch(
+                'ingredient_links',
+                queryset=RecipeIngredient.objects.select_related('ingredient'),
+            ),
+        ]
+
+    def build_fragment(self, instance):
+        data = super().to_representation(instance)
+        for field_name in self.viewer_fields:
+            data.pop(field_name)
+        return data
+
+    def add_viewer_fields(self, fragment, instance):
+        return {
+            **fragment,
+            'author': {
+                **fragment['author'],
+                'is_subscribed': self.fields['author'].get_is_subscribed(
+                    instance.author),
+            },
+            'is_favorited': self.get_is_favorited(instance),
+            'is_in_shopping_cart': self.get_is_in_shopping_cart(instance),
+        }
 
     def get_ingredients(self, obj):
-        links = obj.ingredient_links.select_related('ingredient')
-        return RecipeIngredientReadSerializer(links, many=True).data
+        return RecipeIngredientReadSerializer(
+            obj.ingredient_links.all(), many=True).data
 
     def get_is_favorited(self, obj):
         user = self.context.get('request').user
         if user.is_anonymous:
             return False
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         return Favorite.objects.filter(user=user, recipe=obj).exists()
 
     def get_is_in_shopping_cart(self, obj):
         user = self.context.get('request').user
-        return not user.is_anonymous and obj.shopping_cart.filter(
-            user=user).exists()
+        if user.is_anonymous:
+            return False
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
+        return obj.shopping_cart.filter(user=user).exists()
 
 
 class RecipeWriteSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientWriteSerializer(many=True)
-    tags = serializers.PrimaryKeyRelatedField(
-        many=True, queryset=Tag.objects.all())
-    image = Base64ImageField()
+    tags = BulkPrimaryKeyRelatedField(many=True, queryset=Tag.objects.all())
+    image = ImageUploadField()
 
     class Meta:
         model = Recipe
@@ -128,24 +225,60 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
                 'Время приготовления должно быть >= 1.')
         return value
 
-    def update_recipe_data(self, recipe, ingredients, tags):
-        recipe.tags.set(tags)
-        recipe.ingredient_links.all().delete()
-        RecipeIngredient.objects.bulk_create([
-            RecipeIngredient(
-                recipe=recipe, ingredient=item['id'], amount=item['amount'])
-            for item in ingredients
-        ])
-
+    def update_recipe_data(self, recipe, ingredients, tags, created=False):
+        """Привести теги и ингредиенты рецепта к переданным.
+
+        Текущие связи читаются одним запросом, а в базу уходят только
+        отличия. Возвращает id ингредиентов, которые изменились.
+        """
+        current_tags = set() if created else set(
+            recipe.tags.values_list('pk', flat=True))
+        tag_ids = {tag.pk for tag in tags}
+        if current_tags - tag_ids:
+            recipe.tags.remove(*(current_tags - tag_ids))
+        if tag_ids - current_tags:
+            recipe.tags.add(*(tag_ids - current_tags))
+
+        links = {}
+        stale = []
+        if not created:
+            for link in recipe.ingredient_links.all():
+                if link.ingredient_id in links:
+                    stale.append(link)
+                else:
+                    links[link.ingredient_id] = link
+        new = []
+        changed = []
+        for item in ingredients:
+            link = links.pop(item['id'].pk, None)
+            if link is None:
+                new.append(RecipeIngredient(
+                    recipe=recipe, ingredient=item['id'],
+                    amount=item['amount']))
+            elif link.amount != item['amount']:
+                link.amount = item['amount']
+                changed.append(link)
+        stale.extend(links.values())
+        if stale:
+            RecipeIngredient.objects.filter(
+                pk__in=[link.pk for link in stale]).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ['amount'])
+        if new:
+            RecipeIngredient.objects.bulk_create(new)
+        return {link.ingredient_id for link in (*stale, *changed, *new)}
+
+    @transaction.atomic
     def create(self, validated_data):
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         validated_data.pop('author', None)
         user = self.context['request'].user
         recipe = Recipe.objects.create(author=user, **validated_data)
-        self.update_recipe_data(recipe, ingredients, tags)
+        self.update_recipe_data(recipe, ingredients, tags, created=True)
         return recipe
 
+    @transaction.atomic
     def update(self, instance, validated_data):
         request = self.context['request']
         if instance.author != request.user:
@@ -163,7 +296,10 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
 
         instance = super().update(instance, validated_data)
 
-        self.update_recipe_data(instance, ingredients, tags)
+        changed_ids = self.update_recipe_data(instance, ingredients, tags)
+        if changed_ids:
+            recipe_ingredients_changed.send(
+                sender=Recipe, recipe=instance, ingredient_ids=changed_ids)
 
         return instance
 
@@ -171,42 +307,24 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         return RecipeReadSerializer(instance, context=self.context).data
 
 
-class FavoriteSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = Favorite
-        fields = ['user', 'recipe']
-
-    def validate(self, data):
-        if Favorite.objects.filter(
-                user=data['user'], recipe=data['recipe']).exists():
-            raise serializers.ValidationError('Рецепт уже в избранном.')
-        return data
-
-    def create(self, validated_data):
-        return Favorite.objects.create(**validated_data)
-
-
-class ShoppingCartSerializer(serializers.ModelSerializer):
-    class Meta:
-        model = ShoppingCart
-        fields = ['user', 'recipe']
-
-    def validate(self, data):
-        if ShoppingCart.objects.filter(
-                user=data['user'], recipe=data['recipe']).exists():
-            raise serializers.ValidationError('Рецепт уже в корзине.')
-        return data
-
-    def create(self, validated_data):
-        return ShoppingCart.objects.create(**validated_data)
+class RecipeIdsSerializer(serializers.Serializer):
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.BULK_RECIPES_LIMIT,
+    )
 
 
 class RecipeShortSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField()
+    image_srcset = ImageSrcsetField()
 
     class Meta:
         model = Recipe
-        fields = ['id', 'name', 'image', 'cooking_time']
+        fields = ['id', 'name', 'image', 'image_srcset', 'cooking_time']
+
+    # Поля модели, которых достаточно для ответа.
+    model_fields = ('id', 'name', 'image', 'image_derivatives', 'cooking_time')
 
     def get_image(self, obj):
         request = self.context.get('request')
@@ -218,6 +336,13 @@ class RecipeShortSerializer(serializers.ModelSerializer):
         return None
 
 
+class SubscriptionListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        authors = list(data.all() if isinstance(data, BaseManager) else data)
+        self.child.prefetch_recipes(authors)
+        return super().to_representation(authors)
+
+
 class SubscriptionSerializer(serializers.ModelSerializer):
     recipes = serializers.SerializerMethodField()
     recipes_count = serializers.IntegerField(default=0)
@@ -230,29 +355,56 @@ class SubscriptionSerializer(serializers.ModelSerializer):
             'id', 'username', 'email', 'first_name', 'last_name',
             'avatar', 'recipes', 'recipes_count', 'is_subscribed'
         ]
+        list_serializer_class = SubscriptionListSerializer
 
     def get_avatar(self, obj):
-        request = self.context.get('request')
-        if obj.avatar:
-            url = obj.avatar.url
-            if request is not None:
-                return request.build_absolute_uri(url)
-            return url
-        return None
+        return get_avatar_url(
+            obj, self.context.get('request'), settings.AVATAR_THUMBNAIL_SIZE)
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
         user = request.user if request else None
         if user is None or user.is_anonymous:
             return False
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         return Follow.objects.filter(user=user, following=obj).exists()
 
-    def get_recipes(self, obj):
+    def get_recipes_limit(self):
         request = self.context.get('request')
-        recipes = obj.recipes.all()
         if request:
             limit = request.query_params.get('recipes_limit')
             if limit and limit.isdigit():
-                recipes = recipes[: int(limit)]
+                return int(limit)
+        return None
+
+    def prefetch_recipes(self, authors):
+        """Загрузить рецепты всех авторов страницы одним запросом.
+
+        При заданном recipes_limit последние рецепты каждого автора
+        отбираются оконной функцией ROW_NUMBER() прямо в базе.
+        """
+        recipes = Recipe.objects.filter(author__in=authors).only(
+            'author_id', *RecipeShortSerializer.model_fields)
+        limit = self.get_recipes_limit()
+        if limit is not None:
+            recipes = recipes.annotate(row_number=Window(
+                RowNumber(),
+                partition_by=F('author_id'),
+                order_by=F('id').desc(),
+            )).filter(row_number__lte=limit)
+        recipes_by_author = defaultdict(list)
+        for recipe in recipes.order_by('author_id', '-id'):
+            recipes_by_author[recipe.author_id].append(recipe)
+        for author in authors:
+            author.page_recipes = recipes_by_author[author.pk]
+
+    def get_recipes(self, obj):
+        recipes = getattr(obj, 'page_recipes', None)
+        if recipes is None:
+            recipes = obj.recipes.all()
+            limit = self.get_recipes_limit()
+            if limit is not None:
+                recipes = recipes[:limit]
         return RecipeShortSerializer(
             recipes, many=True, context=self.context).data
@@ -1,7 +1,8 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
+from api.fields import ImageUploadField
 from users.models import Follow
 
 
@@ -19,6 +20,16 @@ class UserAuthSerializer(serializers.ModelSerializer):
         return User.objects.create_user(**validated_data)
 
 
+def get_avatar_url(user, request, size=None):
+    """Ссылка на аватар; при заданном size — на его квадратную копию."""
+    if not user.avatar:
+        return None
+    url = user.avatar.storage.url(user.get_avatar_name(size))
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
 class UserFullSerializer(serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField()
     avatar = serializers.SerializerMethodField()
@@ -28,11 +39,14 @@ class UserFullSerializer(serializers.ModelSerializer):
         fields = ['id', 'username', 'email', 'first_name',
                         'last_name', 'is_subscribed', 'avatar']
 
+    # Сторона копии аватара в ответе; None — оригинал.
+    avatar_size = None
+
     def get_avatar(self, obj):
         request = self.context.get('request')
-        if obj.avatar and request:
-            return request.build_absolute_uri(obj.avatar.url)
-        return None
+        if request is None:
+            return None
+        return get_avatar_url(obj, request, self.avatar_size)
 
     def get_is_subscribed(self, obj):
         request = self.context.get('request')
@@ -41,11 +55,41 @@ class UserFullSerializer(serializers.ModelSerializer):
         if not user or user.is_anonymous:
             return False
 
-        return Follow.objects.filter(user=user, following=obj).exists()
+        return obj.id in self.get_subscribed_ids(user, [obj.id])
+
+    def get_subscribed_ids(self, user, author_ids):
+        """Авторы страницы, на которых подписан пользователь.
+
+        Подписки проверяются одним запросом сразу для всех пользователей
+        страницы и сохраняются в общем контексте, поэтому вложенные
+        сериализаторы авторов не обращаются к базе для каждой строки,
+        а размер ответа базы не зависит от числа подписок.
+        """
+        checked = self.context.setdefault('subscriptions_checked', set())
+        subscribed = self.context.setdefault('subscribed_ids', set())
+        missing = set(author_ids) - checked
+        if not missing:
+            return subscribed
+        if isinstance(self.parent, serializers.ListSerializer) and (
+                self.parent.instance is not None):
+            missing.update(
+                item.pk for item in self.parent.instance
+                if item.pk not in checked)
+        subscribed.update(
+            user.subscriptions.filter(following_id__in=missing)
+            .values_list('following_id', flat=True))
+        checked.update(missing)
+        return subscribed
+
+
+class AuthorSerializer(UserFullSerializer):
+    """Автор в карточках рецептов: с маленькой копией аватара."""
+
+    avatar_size = settings.AVATAR_THUMBNAIL_SIZE
 
 
 class AvatarSerializer(serializers.ModelSerializer):
-    avatar = Base64ImageField(allow_null=True)
+    avatar = ImageUploadField(allow_null=True)
 
     class Meta:
         model = User
@@ -0,0 +1,151 @@
+"""Выгрузка списка покупок в разных форматах.
+
+Текстовые форматы отдаются потоком по мере чтения строк из базы,
+PDF собирается в отдельном пуле процессов. Процессы пула запускаются
+через spawn, а не fork: воркер gunicorn к этому моменту уже держит
+потоки пула изображений и соединение с базой.
+"""
+import csv
+import io
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import (
+    ProcessPoolExecutor,
+    TimeoutError as FutureTimeoutError,
+)
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
+
+
+logger = logging.getLogger(__name__)
+
+CSV_HEADER = ('Ингредиент', 'Единица измерения', 'Количество')
+
+pdf_executor = None
+
+
+class ExportError(Exception):
+    """Файл списка покупок сейчас собрать не удалось."""
+
+
+class Echo:
+    """Буфер для csv.writer, который сразу возвращает записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def stream_text(items):
+    for item in items:
+        yield f"{item['name']} ({item['unit']}) {item['total']}\n"
+
+
+def stream_csv(items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(CSV_HEADER)
+    for item in items:
+        yield writer.writerow((item['name'], item['unit'], item['total']))
+
+
+def stream_json(items):
+    separator = ''
+    yield '['
+    for item in items:
+        yield separator + json.dumps({
+            'name': item['name'],
+            'measurement_unit': item['unit'],
+            'amount': item['total'],
+        }, ensure_ascii=False)
+        separator = ','
+    yield ']'
+
+
+STREAMING_FORMATS = {
+    'txt': ('text/plain; charset=utf-8', stream_text),
+    'csv': ('text/csv; charset=utf-8', stream_csv),
+    'json': ('application/json', stream_json),
+}
+EXPORT_FORMATS = (*STREAMING_FORMATS, 'pdf')
+
+
+def render_pdf(rows, font_path):
+    """Собрать PDF; выполняется в процессе из пула."""
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    from reportlab.pdfgen import canvas
+
+    pdfmetrics.registerFont(TTFont('ShoppingList', font_path))
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    width, height = A4
+    top = height - 50
+    y = top
+    pdf.setFont('ShoppingList', 16)
+    pdf.drawString(50, y, 'Список покупок')
+    y -= 30
+    pdf.setFont('ShoppingList', 12)
+    for name, unit, total in rows:
+        if y < 50:
+            pdf.showPage()
+            pdf.setFont('ShoppingList', 12)
+            y = top
+        pdf.drawString(50, y, f'{name} ({unit}) — {total}')
+        y -= 18
+    pdf.save()
+    return buffer.getvalue()
+
+
+def get_pdf_executor():
+    global pdf_executor
+    if pdf_executor is None:
+        pdf_executor = ProcessPoolExecutor(
+            max_workers=settings.SHOPPING_LIST_PDF_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+        )
+    return pdf_executor
+
+
+def build_pdf(rows):
+    """Собрать PDF в пуле процессов; ошибки сводятся к ExportError."""
+    global pdf_executor
+    font_path = settings.SHOPPING_LIST_PDF_FONT
+    if not os.path.isfile(font_path):
+        logger.error('Не найден шрифт для PDF: %s', font_path)
+        raise ExportError('Выгрузка в PDF сейчас недоступна.')
+    try:
+        future = get_pdf_executor().submit(render_pdf, rows, font_path)
+        return future.result(timeout=settings.SHOPPING_LIST_PDF_TIMEOUT)
+    except FutureTimeoutError:
+        future.cancel()
+        raise ExportError(
+            'Список покупок собирается слишком долго, попробуйте позже.')
+    except BrokenProcessPool:
+        logger.exception('Пул сборки PDF остановлен, создаётся заново')
+        pdf_executor = None
+        raise ExportError('Выгрузка в PDF сейчас недоступна.')
+    except Exception:
+        logger.exception('Не удалось собрать PDF списка покупок')
+        raise ExportError('Выгрузка в PDF сейчас недоступна.')
+
+
+def export_shopping_list(items, export_format):
+    """Ответ с файлом списка покупок в выбранном формате.
+
+    Если PDF собрать не удалось, выбрасывает ExportError.
+    """
+    filename = f'shopping_list.{export_format}'
+    if export_format == 'pdf':
+        rows = [(item['name'], item['unit'], item['total']) for item in items]
+        response = HttpResponse(
+            build_pdf(rows), content_type='application/pdf')
+    else:
+        content_type, stream = STREAMING_FORMATS[export_format]
+        response = StreamingHttpResponse(
+            stream(items), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
@@ -0,0 +1,105 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from api.cache import bump_versions, drop_versions
+from recept.models import (
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    Tag,
+)
+from recept.signals import (
+    ingredients_loaded,
+    recipe_ingredients_changed,
+    recipe_scores_updated,
+    recipes_added,
+)
+from users.models import Follow
+
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=Recipe)
+def invalidate_recipe(sender, instance, **kwargs):
+    bump_versions('recipes', f'recipe:{instance.pk}')
+
+
+@receiver(post_delete, sender=Recipe)
+def invalidate_deleted_recipe(sender, instance, **kwargs):
+    bump_versions('recipes')
+    drop_versions(f'recipe:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+def invalidate_recipe_ingredients(sender, instance, **kwargs):
+    bump_versions('recipes', f'recipe:{instance.recipe_id}')
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(sender, instance, action, reverse, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if reverse:
+        bump_versions('recipes', 'tags')
+    else:
+        bump_versions('recipes', f'recipe:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def invalidate_tags(sender, **kwargs):
+    bump_versions('tags')
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+@receiver(ingredients_loaded, sender=Ingredient)
+def invalidate_ingredients(sender, **kwargs):
+    bump_versions('ingredients')
+
+
+@receiver(post_save, sender=User)
+def invalidate_user(sender, instance, update_fields=None, **kwargs):
+    if update_fields and set(update_fields) == {'last_login'}:
+        return
+    bump_versions('users', f'user:{instance.pk}')
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_user(sender, instance, **kwargs):
+    bump_versions('users')
+    drop_versions(f'user:{instance.pk}', f'viewer:{instance.pk}')
+
+
+@receiver([post_save, post_delete], sender=Favorite)
+@receiver([post_save, post_delete], sender=ShoppingCart)
+@receiver([post_save, post_delete], sender=Follow)
+def invalidate_viewer(sender, instance, **kwargs):
+    bump_versions(f'viewer:{instance.user_id}')
+
+
+@receiver(recipes_added, sender=Favorite)
+@receiver(recipes_added, sender=ShoppingCart)
+def invalidate_viewer_bulk(sender, user_id, **kwargs):
+    bump_versions(f'viewer:{user_id}')
+
+
+@receiver(recipe_scores_updated)
+def invalidate_recipe_order(sender, **kwargs):
+    bump_versions('recipes')
+
+
+@receiver([post_save, post_delete], sender=Recipe)
+def reindex_recipe(sender, instance, created=True, **kwargs):
+    # Состав рецепта меняется только при создании и удалении; правки
+    # ингредиентов приходят отдельными сигналами ниже.
+    if created:
+        bump_versions('recipe-ingredients')
+
+
+@receiver([post_save, post_delete], sender=RecipeIngredient)
+@receiver(recipe_ingredients_changed, sender=Recipe)
+def reindex_recipe_ingredients(sender, **kwargs):
+    bump_versions('recipe-ingredients')
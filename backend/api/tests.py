@@ -0,0 +1,538 @@
+import io
+import re
+import tempfile
+import threading
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connection
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api.cache import bump_versions, get_versions
+from api.filters import RecipeFilter
+from api.search import RecipeIngredientIndex, has_trigram_extension
+from recept.models import (
+    DataVersion,
+    Favorite,
+    Ingredient,
+    Recipe,
+    RecipeIngredient,
+    ShoppingCart,
+    ShoppingListItem,
+    Tag,
+)
+from users.models import Follow, User
+
+
+def create_user(username):
+    return User.objects.create_user(
+        username=username, email=f'{username}@example.com', password='pass',
+        first_name=username, last_name=username,
+    )
+
+
+class RecipeReadQueriesTest(TestCase):
+    """Число запросов при чтении рецептов не зависит от размера страницы."""
+
+    # Версии для ETag, COUNT, рецепты, версии фрагментов, теги,
+    # ингредиенты; из тёплого кеша фрагментов теги и ингредиенты
+    # не читаются.
+    LIST_COLD = 6
+    LIST_WARM = 4
+    # Детальная страница — то же без COUNT.
+    DETAIL_COLD = 5
+    DETAIL_WARM = 3
+    # Подписки зрителя на авторов страницы — один запрос на страницу.
+    VIEWER = 1
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = create_user('viewer')
+        tags = [
+            Tag.objects.create(name=f'Тег {index}', slug=f'tag{index}')
+            for index in range(3)
+        ]
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(5)
+        ]
+        for author_index in range(3):
+            author = create_user(f'author{author_index}')
+            Follow.objects.create(user=cls.viewer, following=author)
+            for index in range(5):
+                recipe = Recipe.objects.create(
+                    author=author, name=f'Рецепт {author_index}-{index}',
+                    text='Описание', cooking_time=10,
+                    image='recipes/recipe.png',
+                )
+                recipe.tags.set(tags[:index % 3 + 1])
+                RecipeIngredient.objects.bulk_create(
+                    RecipeIngredient(
+                        recipe=recipe, ingredient=ingredient, amount=100)
+                    for ingredient in ingredients[:index + 1]
+                )
+                Favorite.objects.create(user=cls.viewer, recipe=recipe)
+                if index % 2:
+                    ShoppingCart.objects.create(
+                        user=cls.viewer, recipe=recipe)
+        cls.recipe = Recipe.objects.order_by('id').first()
+
+    def setUp(self):
+        cache.clear()
+        # Начальная версия заводится один раз на всю базу.
+        get_versions([])
+
+    def get_client(self, authenticated):
+        client = APIClient()
+        if authenticated:
+            client.force_authenticate(self.viewer)
+        return client
+
+    def assert_queries(self, client, url, cold, warm):
+        cache.clear()
+        with self.assertNumQueries(cold):
+            response = client.get(url)
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(warm):
+            client.get(url)
+        return response.json()
+
+    def test_list(self):
+        for authenticated in (False, True):
+            client = self.get_client(authenticated)
+            extra = self.VIEWER if authenticated else 0
+            for limit in (2, 10):
+                with self.subTest(authenticated=authenticated, limit=limit):
+                    data = self.assert_queries(
+                        client, f'/api/recipes/?limit={limit}',
+                        self.LIST_COLD + extra, self.LIST_WARM + extra,
+                    )
+                    self.assertEqual(len(data['results']), limit)
+
+    def test_detail(self):
+        for authenticated in (False, True):
+            client = self.get_client(authenticated)
+            extra = self.VIEWER if authenticated else 0
+            with self.subTest(authenticated=authenticated):
+                data = self.assert_queries(
+                    client, f'/api/recipes/{self.recipe.pk}/',
+                    self.DETAIL_COLD + extra, self.DETAIL_WARM + extra,
+                )
+                self.assertEqual(data['id'], self.recipe.pk)
+
+    def test_viewer_fields(self):
+        data = self.get_client(True).get('/api/recipes/?limit=10').json()
+        for item in data['results']:
+            self.assertTrue(item['is_favorited'])
+            self.assertTrue(item['author']['is_subscribed'])
+
+    def get_follow_queries(self, url):
+        with CaptureQueriesContext(connection) as context:
+            data = self.get_client(True).get(url).json()
+        return data, [
+            query['sql'] for query in context.captured_queries
+            if Follow._meta.db_table in query['sql']
+        ]
+
+    def test_subscriptions_limited_to_page(self):
+        # Подписки вне страницы не загружаются.
+        for index in range(20):
+            Follow.objects.create(
+                user=self.viewer, following=create_user(f'other{index}'))
+        data, queries = self.get_follow_queries('/api/recipes/?limit=2')
+        [query] = queries
+        loaded = re.search(r'"following_id" IN \(([^)]*)\)', query)
+        self.assertEqual(
+            {int(pk) for pk in loaded.group(1).split(', ')},
+            {item['author']['id'] for item in data['results']},
+        )
+
+    def test_user_list_subscriptions(self):
+        data, queries = self.get_follow_queries('/api/users/?limit=10')
+        self.assertEqual(len(queries), 1)
+        subscribed = {
+            item['id'] for item in data['results'] if item['is_subscribed']}
+        self.assertEqual(
+            subscribed,
+            set(self.viewer.subscriptions.values_list(
+                'following_id', flat=True)))
+
+
+class DataVersionTest(TestCase):
+    """Версии наборов данных читаются и сдвигаются одним запросом."""
+
+    def test_bump(self):
+        epoch = get_versions(['recipes'])['recipes']
+        with self.captureOnCommitCallbacks() as callbacks:
+            bump_versions('recipes', 'recipe:1', 'recipe:1')
+        with self.assertNumQueries(1):
+            for callback in callbacks:
+                callback()
+        with self.assertNumQueries(1):
+            versions = get_versions(['recipes', 'recipe:1', 'recipe:2'])
+        self.assertGreater(versions['recipes'], epoch)
+        self.assertEqual(versions['recipes'], versions['recipe:1'])
+        self.assertEqual(versions['recipe:2'], epoch)
+
+    def test_deleted_recipe_dropped(self):
+        recipe = Recipe.objects.create(
+            author=create_user('author'), name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/recipe.png',
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.save()
+        self.assertTrue(
+            DataVersion.objects.filter(name=f'recipe:{recipe.pk}').exists())
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertFalse(
+            DataVersion.objects.filter(name=f'recipe:{recipe.pk}').exists())
+
+
+class RecipeIngredientIndexTest(TestCase):
+    """Индекс видит изменения состава, сделанные в других процессах."""
+
+    def setUp(self):
+        self.author = create_user('author')
+        self.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {index}', measurement_unit='г')
+            for index in range(2)
+        ]
+        self.index = RecipeIngredientIndex()
+
+    def create_recipe(self, ingredient):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.create(
+                author=self.author, name='Рецепт', text='Описание',
+                cooking_time=10, image='recipes/recipe.png',
+            )
+            RecipeIngredient.objects.create(
+                recipe=recipe, ingredient=ingredient, amount=100)
+        return recipe
+
+    def found(self, ingredient):
+        return [
+            recipe_id for recipe_id, _, _ in self.index.search([ingredient.pk])
+        ]
+
+    def test_changes_from_other_process(self):
+        first, second = self.ingredients
+        recipe = self.create_recipe(first)
+        self.assertEqual(self.found(first), [recipe.pk])
+        # Изменения приходят только через общую версию: локальное
+        # состояние индекса никто не трогает.
+        other = self.create_recipe(second)
+        self.assertEqual(self.found(second), [other.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.ingredient_links.update(ingredient=second)
+            bump_versions('recipe-ingredients')
+        self.assertEqual(self.found(first), [])
+        self.assertEqual(
+            sorted(self.found(second)), sorted([recipe.pk, other.pk]))
+        with self.captureOnCommitCallbacks(execute=True):
+            other.delete()
+        self.assertEqual(self.found(second), [recipe.pk])
+
+
+class IngredientAutocompleteQueriesTest(TestCase):
+    """Подсказки из индекса в памяти стоят один запрос — версию для ETag."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('соль', 'сода', 'сахар'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def test_autocomplete(self):
+        client = APIClient()
+        client.get('/api/ingredients/', {'name': 'с'})
+        for params in ({'name': 'со'}, {'search': 'со'}):
+            with self.subTest(**params), self.assertNumQueries(1):
+                response = client.get('/api/ingredients/', params)
+            self.assertEqual(
+                [item['name'] for item in response.json()][:2],
+                ['сода', 'соль'])
+
+
+@override_settings(INGREDIENT_INDEX_ENABLED=False)
+class IngredientSearchInDbTest(TestCase):
+    """Поиск ингредиентов в базе работает и без pg_trgm."""
+
+    @classmethod
+    def setUpTestData(cls):
+        for name in ('соль', 'морская соль', 'фасоль', 'сахар'):
+            Ingredient.objects.create(name=name, measurement_unit='г')
+
+    def test_search(self):
+        response = APIClient().get('/api/ingredients/', {'search': 'соль'})
+        self.assertEqual(response.status_code, 200)
+        names = [item['name'] for item in response.json()]
+        self.assertEqual(names[:3], ['соль', 'морская соль', 'фасоль'])
+        if not has_trigram_extension():
+            self.assertEqual(len(names), 3)
+
+
+class RecipeRelationRaceTest(TransactionTestCase):
+    """Параллельные добавления одной пары (пользователь, рецепт)."""
+
+    THREADS = 16
+
+    def setUp(self):
+        self.user = create_user('user')
+        # Уменьшенные копии помечены готовыми, чтобы их фоновая сборка
+        # не обращалась к базе во время очистки между тестами.
+        self.recipe = Recipe.objects.create(
+            author=create_user('author'), name='Рецепт', text='Описание',
+            cooking_time=10, image='recipes/recipe.png',
+            image_derivatives={'source': 'recipes/recipe.png', 'formats': {}},
+        )
+        self.amounts = {}
+        for index, amount in enumerate((100, 50)):
+            ingredient = Ingredient.objects.create(
+                name=f'Ингредиент {index}', measurement_unit='г')
+            RecipeIngredient.objects.create(
+                recipe=self.recipe, ingredient=ingredient, amount=amount)
+            self.amounts[ingredient.pk] = amount
+
+    def run_parallel(self, requests):
+        """Выполнить запросы одновременно, каждый в своём соединении."""
+        barrier = threading.Barrier(len(requests))
+        responses = [None] * len(requests)
+
+        def post(index, url, data):
+            client = APIClient()
+            client.force_authenticate(self.user)
+            try:
+                barrier.wait()
+                responses[index] = client.post(url, data, format='json')
+            finally:
+                connection.close()
+
+        threads = [
+            threading.Thread(target=post, args=(index, *request))
+            for index, request in enumerate(requests)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return responses
+
+    def single(self, name):
+        return f'/api/recipes/{self.recipe.pk}/{name}/', None
+
+    def bulk(self, name):
+        return f'/api/recipes/{name}/bulk/', {'recipes': [self.recipe.pk]}
+
+    def assert_added_once(self, responses):
+        added = 0
+        for response in responses:
+            if response.status_code == 200:
+                [item] = response.json()
+                self.assertIn(item['status'], ('added', 'exists'))
+                added += item['status'] == 'added'
+            else:
+                self.assertIn(response.status_code, (201, 400))
+                added += response.status_code == 201
+        self.assertEqual(added, 1)
+
+    def assert_counters(self):
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+        self.assertEqual(self.recipe.in_carts_count, 1)
+        self.assertEqual(Favorite.objects.count(), 1)
+        self.assertEqual(ShoppingCart.objects.count(), 1)
+        self.assertEqual(
+            dict(ShoppingListItem.objects.filter(user=self.user)
+                 .values_list('ingredient_id', 'total')),
+            self.amounts,
+        )
+
+    def test_single(self):
+        for name in ('favorite', 'shopping_cart'):
+            responses = self.run_parallel([self.single(name)] * self.THREADS)
+            self.assertEqual(
+                sorted(response.status_code for response in responses),
+                [201] + [400] * (self.THREADS - 1),
+            )
+        self.assert_counters()
+
+    def test_bulk(self):
+        for name in ('favorite', 'shopping_cart'):
+            self.assert_added_once(
+                self.run_parallel([self.bulk(name)] * self.THREADS))
+        self.assert_counters()
+
+    def test_single_and_bulk(self):
+        for name in ('favorite', 'shopping_cart'):
+            self.assert_added_once(self.run_parallel(
+                [self.single(name), self.bulk(name)] * (self.THREADS // 2)))
+        self.assert_counters()
+
+
+class RecipeFilterPlanTest(TestCase):
+    """Фильтры по тегам и избранному не размножают строки рецептов."""
+
+    RECIPES = 300
+    QUERY = {'tags': ['tag0', 'tag1'], 'is_favorited': '1'}
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.viewer = create_user('viewer')
+        author = create_user('author')
+        tags = [
+            Tag.objects.create(name=f'Тег {index}', slug=f'tag{index}')
+            for index in range(4)
+        ]
+        recipes = Recipe.objects.bulk_create(
+            Recipe(
+                author=author, name=f'Рецепт {index}', text='Описание',
+                cooking_time=10, image='recipes/recipe.png',
+            )
+            for index in range(cls.RECIPES)
+        )
+        # Каждый рецепт — с двумя-тремя тегами, часть из них — с обоими
+        # искомыми, поэтому соединение по тегам дало бы повторы.
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for index, recipe in enumerate(recipes)
+            for tag in tags[index % 2:index % 2 + 2 + index % 3 % 2]
+        )
+        Favorite.objects.bulk_create(
+            Favorite(user=cls.viewer, recipe=recipe)
+            for recipe in recipes[::2]
+        )
+        cls.expected = {
+            recipe.pk for recipe in Recipe.objects.filter(
+                tags__slug__in=cls.QUERY['tags'],
+                favorited_by__user=cls.viewer,
+            )
+        }
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+
+    def setUp(self):
+        cache.clear()
+
+    def test_no_duplicates(self):
+        client = APIClient()
+        client.force_authenticate(self.viewer)
+        data = client.get(
+            '/api/recipes/', {**self.QUERY, 'limit': self.RECIPES}).json()
+        ids = [item['id'] for item in data['results']]
+        self.assertEqual(len(ids), len(set(ids)))
+        self.assertEqual(set(ids), self.expected)
+        self.assertEqual(data['count'], len(self.expected))
+
+    def test_plan_without_distinct(self):
+        request = APIRequestFactory().get('/api/recipes/', self.QUERY)
+        request.user = self.viewer
+        queryset = RecipeFilter(
+            request.GET, Recipe.objects.all(), request=request).qs
+        for query in (queryset, queryset.values('pk').order_by()):
+            sql, params = query.query.sql_with_params()
+            self.assertNotIn('DISTINCT', sql)
+            with connection.cursor() as cursor:
+                cursor.execute(f'EXPLAIN {sql}', params)
+                plan = '\n'.join(row for row, in cursor.fetchall())
+            self.assertNotIn('Unique', plan)
+            self.assertNotIn('HashAggregate', plan)
+
+
+class ImageReleaseTest(TestCase):
+    """Удаление изображения не трогает файлы, на которые ещё есть ссылки."""
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.author = create_user('author')
+
+    def save_file(self, name, content):
+        return default_storage.save(name, ContentFile(content))
+
+    def save_image(self, name, color='orange'):
+        buffer = io.BytesIO()
+        Image.new('RGB', (1000, 600), color).save(buffer, 'PNG')
+        return self.save_file(name, buffer.getvalue())
+
+    def reupload(self, name, upload_to):
+        """Загрузить чужой файл заново, как сделал бы клиент API."""
+        with default_storage.open(name) as file:
+            return self.save_file(f'{upload_to}/upload.webp', file.read())
+
+    def create_recipe(self, image, **kwargs):
+        return Recipe.objects.create(
+            author=self.author, name='Рецепт', text='Описание',
+            cooking_time=10, image=image, **kwargs)
+
+    def test_recipe_derivative_reupload(self):
+        recipe = self.create_recipe(self.save_image('recipes/source.png'))
+        recipe.build_image_derivatives()
+        derivatives = [
+            variant['name']
+            for variants in recipe.image_derivatives['formats'].values()
+            for variant in variants
+        ]
+        other = self.create_recipe(
+            self.reupload(derivatives[0], 'recipes'))
+        self.assertNotIn(other.image.name, derivatives)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertTrue(default_storage.exists(other.image.name))
+        self.assertFalse(default_storage.exists(recipe.image.name))
+        for name in derivatives:
+            self.assertFalse(default_storage.exists(name))
+
+    def test_recipe_legacy_derivative_kept(self):
+        # До выноса копий в derivatives/ копия могла совпасть по имени
+        # с загрузкой.
+        shared = self.save_image('recipes/shared.png', 'green')
+        other = self.create_recipe(shared)
+        image = self.save_image('recipes/source.png')
+        recipe = self.create_recipe(image, image_derivatives={
+            'source': image,
+            'formats': {'webp': [{'name': shared, 'width': 480}]},
+        })
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe.delete()
+        self.assertTrue(default_storage.exists(other.image.name))
+        self.assertFalse(default_storage.exists(image))
+
+    def test_avatar_variant_reupload(self):
+        owner = create_user('owner')
+        owner.avatar = self.save_image('avatars/source.png')
+        owner.save()
+        owner.build_avatar_variants()
+        variants = list(owner.avatar_variants['sizes'].values())
+        other = create_user('other')
+        other.avatar = self.reupload(variants[-1], 'avatars')
+        other.save()
+        self.assertNotIn(other.avatar.name, variants)
+        with self.captureOnCommitCallbacks(execute=True):
+            owner.avatar = None
+            owner.save()
+        self.assertTrue(default_storage.exists(other.avatar.name))
+        for name in variants:
+            self.assertFalse(default_storage.exists(name))
+
+    def test_avatar_legacy_variant_kept(self):
+        shared = self.save_image('avatars/shared.png', 'green')
+        other = create_user('other')
+        other.avatar = shared
+        other.save()
+        owner = create_user('owner')
+        owner.avatar = self.save_image('avatars/source.png')
+        owner.avatar_variants = {
+            'source': owner.avatar.name, 'sizes': {'256': shared}}
+        owner.save()
+        with self.captureOnCommitCallbacks(execute=True):
+            owner.delete()
+        self.assertTrue(default_storage.exists(shared))
@@ -1,7 +1,9 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import Exists, F, OuterRef, Sum
-from django.http import HttpResponse
+from django.db import connection, transaction
+from django.db.models import Exists, F, OuterRef, Subquery
 from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, status, viewsets
 from rest_framework.decorators import action
@@ -13,38 +15,88 @@ from rest_framework.response import Response
 from rest_framework.viewsets import ReadOnlyModelViewSet
 
 from api.filters import IngredientFilter, RecipeFilter
+from api.mixins import ConditionalGetMixin
+from api.negotiation import IgnoreFormatContentNegotiation
+from api.paginations import (
+    LimitCursorPagination,
+    LimitPageNumberOrCursorPagination,
+    LimitPageNumberPagination,
+)
 from api.permissions import IsAuthorOrReadOnly
+from api.search import (
+    ingredient_index,
+    recipe_ingredient_index,
+    search_ingredients_in_db,
+)
 from api.serializers.recipes import (
-    FavoriteSerializer,
     IngredientSerializer,
+    RecipeIdsSerializer,
     RecipeReadSerializer,
     RecipeShortSerializer,
     RecipeWriteSerializer,
-    ShoppingCartSerializer,
     TagSerializer,
 )
+from api.shopping_list import EXPORT_FORMATS, ExportError, export_shopping_list
 from recept.models import (
     Favorite,
+    FeedItem,
     Ingredient,
     Recipe,
-    RecipeIngredient,
     ShoppingCart,
+    ShoppingListItem,
     Tag,
 )
+from recept.signals import recipes_added
+from users.models import Follow
 
 
 User = get_user_model()
 
 
-class RecipeViewSet(viewsets.ModelViewSet):
+def insert_recipe_relations(model, user_id, recipe_ids):
+    """Добавить рецепты в избранное или корзину пользователя.
+
+    Вставка идёт одним INSERT ... ON CONFLICT DO NOTHING RETURNING, поэтому
+    возвращаются только строки, добавленные именно этим запросом: рецепт,
+    параллельно добавленный другим запросом, в результат не попадёт.
+    Несуществующие рецепты пропускаются.
+    """
+    quote = connection.ops.quote_name
+    user_column = quote(model._meta.get_field('user').column)
+    recipe_column = quote(model._meta.get_field('recipe').column)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {quote(model._meta.db_table)} '
+            f'({user_column}, {recipe_column}, created_at) '
+            f'SELECT %s, id, %s FROM {quote(Recipe._meta.db_table)} '
+            'WHERE id = ANY(%s) '
+            f'ON CONFLICT ({user_column}, {recipe_column}) DO NOTHING '
+            f'RETURNING {recipe_column}',
+            [user_id, timezone.now(), list(recipe_ids)],
+        )
+        return [recipe_id for recipe_id, in cursor.fetchall()]
+
+
+class RecipeViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     permission_classes = [IsAuthenticatedOrReadOnly, IsAuthorOrReadOnly]
     filter_backends = [DjangoFilterBackend]
     filterset_class = RecipeFilter
+    pagination_class = LimitPageNumberOrCursorPagination
+    version_names = ('recipes', 'tags', 'ingredients', 'users')
+    viewer_dependent = True
+
+    def get_version_names(self, instance=None):
+        if instance is None:
+            return super().get_version_names()
+        return [
+            f'recipe:{instance.pk}', f'user:{instance.author_id}',
+            'tags', 'ingredients',
+        ]
 
     def get_queryset(self):
         user = self.request.user
-        queryset = Recipe.objects.select_related(
-            'author').prefetch_related('tags', 'ingredients')
+        queryset = Recipe.objects.select_related('author').defer(
+            'search_vector')
         if user.is_authenticated:
             queryset = queryset.annotate(
                 is_favorited=Exists(
@@ -65,57 +117,126 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
-    @action(detail=True, methods=['post', 'delete'],
-            permission_classes=[IsAuthenticated])
-    def favorite(self, request, pk=None):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        user = request.user
-
-        if request.method == 'POST':
-            data = {'user': user.id, 'recipe': recipe.id}
-            serializer = FavoriteSerializer(
-                data=data, context={'request': request})
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(
-                RecipeShortSerializer(
-                    recipe, context={'request': request}).data,
-                status=status.HTTP_201_CREATED
-            )
+    def change_recipe_relation(self, request, pk, model, exists_error,
+                               missing_error):
+        """Добавить рецепт в избранное или корзину либо убрать его оттуда.
 
+        Добавление идёт тем же INSERT ... ON CONFLICT DO NOTHING, что и
+        пакетное: пустой RETURNING значит, что рецепт уже добавлен или
+        параллельно удалён.
+        """
         if request.method == 'DELETE':
-            deleted_count, _ = Favorite.objects.filter(
-                user=user, recipe=recipe).delete()
+            recipe = get_object_or_404(Recipe.objects.only('id'), pk=pk)
+            deleted_count, _ = model.objects.filter(
+                user=request.user, recipe=recipe).delete()
             if deleted_count == 0:
-                return Response({'errors': 'Рецепт не был в избранном.'},
+                return Response({'errors': missing_error},
                                 status=status.HTTP_400_BAD_REQUEST)
             return Response(status=status.HTTP_204_NO_CONTENT)
 
+        recipe = get_object_or_404(
+            Recipe.objects.only(*RecipeShortSerializer.model_fields), pk=pk)
+        with transaction.atomic():
+            added = insert_recipe_relations(
+                model, request.user.pk, [recipe.pk])
+            if added:
+                recipes_added.send(
+                    sender=model, user_id=request.user.pk, recipe_ids=added)
+        if not added:
+            get_object_or_404(Recipe.objects.only('id'), pk=pk)
+            return Response({'non_field_errors': [exists_error]},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response(
+            RecipeShortSerializer(recipe, context={'request': request}).data,
+            status=status.HTTP_201_CREATED
+        )
+
+    @action(detail=True, methods=['post', 'delete'],
+            permission_classes=[IsAuthenticated])
+    def favorite(self, request, pk=None):
+        return self.change_recipe_relation(
+            request, pk, Favorite,
+            'Рецепт уже в избранном.', 'Рецепт не был в избранном.')
+
     @action(detail=True, methods=['post', 'delete'],
             permission_classes=[IsAuthenticated])
     def shopping_cart(self, request, pk=None):
-        recipe = get_object_or_404(Recipe, pk=pk)
-        user = request.user
+        return self.change_recipe_relation(
+            request, pk, ShoppingCart,
+            'Рецепт уже в корзине.', 'Рецепт не был в корзине.')
 
-        if request.method == 'POST':
-            data = {'user': user.id, 'recipe': recipe.id}
-            serializer = ShoppingCartSerializer(
-                data=data, context={'request': request})
-            serializer.is_valid(raise_exception=True)
-            serializer.save()
-            return Response(
-                RecipeShortSerializer(
-                    recipe, context={'request': request}).data,
-                status=status.HTTP_201_CREATED
-            )
+    def change_recipes_bulk(self, request, model):
+        """Добавить или убрать несколько рецептов одним запросом.
 
-        if request.method == 'DELETE':
-            deleted_count, _ = ShoppingCart.objects.filter(
-                user=user, recipe=recipe).delete()
-            if deleted_count == 0:
-                return Response({'errors': 'Рецепт не был в корзине.'},
-                                status=status.HTTP_400_BAD_REQUEST)
-            return Response(status=status.HTTP_204_NO_CONTENT)
+        Возвращает статус для каждого переданного id.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = list(dict.fromkeys(serializer.validated_data['recipes']))
+        found = set(
+            Recipe.objects.filter(pk__in=recipe_ids)
+            .values_list('pk', flat=True))
+        with transaction.atomic():
+            if request.method == 'POST':
+                added = insert_recipe_relations(
+                    model, request.user.pk, recipe_ids)
+                if added:
+                    recipes_added.send(
+                        sender=model, user_id=request.user.pk,
+                        recipe_ids=added)
+                statuses = dict.fromkeys(found, 'exists')
+                statuses.update(dict.fromkeys(added, 'added'))
+            else:
+                # Блокировка не даёт параллельному запросу удалить те же
+                # строки и второй раз отправить сигналы удаления.
+                relations = model.objects.filter(
+                    user=request.user, recipe_id__in=found)
+                present = set(
+                    relations.select_for_update()
+                    .values_list('recipe_id', flat=True))
+                if present:
+                    relations.delete()
+                statuses = dict.fromkeys(found, 'missing')
+                statuses.update(dict.fromkeys(present, 'removed'))
+        return Response([
+            {'id': pk, 'status': statuses.get(pk, 'not_found')}
+            for pk in recipe_ids
+        ])
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='favorite/bulk', permission_classes=[IsAuthenticated])
+    def favorite_bulk(self, request):
+        return self.change_recipes_bulk(request, Favorite)
+
+    @action(detail=False, methods=['post', 'delete'],
+            url_path='shopping_cart/bulk',
+            permission_classes=[IsAuthenticated])
+    def shopping_cart_bulk(self, request):
+        return self.change_recipes_bulk(request, ShoppingCart)
+
+    @action(detail=False, methods=['get'],
+            permission_classes=[IsAuthenticated],
+            pagination_class=LimitCursorPagination)
+    def feed(self, request):
+        """Рецепты авторов, на которых подписан пользователь.
+
+        При большом числе подписок лента читается из заранее заполненной
+        таблицы, иначе собирается запросом по подпискам. Пока готовая
+        лента пуста (ещё не заполнена), она тоже собирается запросом.
+        """
+        user = request.user
+        queryset = self.get_queryset()
+        if (
+            user.subscriptions_count >= settings.FEED_FANOUT_ON_WRITE_THRESHOLD
+            and FeedItem.objects.filter(user=user).exists()
+        ):
+            queryset = queryset.filter(feed_items__user=user)
+        else:
+            queryset = queryset.filter(author__in=Subquery(
+                Follow.objects.filter(user=user).values('following_id')))
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['get'],
             url_name='get-link', url_path='get-link')
@@ -124,42 +245,109 @@ class RecipeViewSet(viewsets.ModelViewSet):
         short_link = request.build_absolute_uri(f'/recipes/{recipe.id}/')
         return Response({'short-link': short_link}, status=status.HTTP_200_OK)
 
-    @action(detail=False, methods=['get'], url_path='download_shopping_cart')
+    @action(detail=True, methods=['get'])
+    def similar(self, request, pk=None):
+        """Похожие рецепты из заранее посчитанной таблицы.
+
+        Таблицу заполняет команда build_similar_recipes; здесь только
+        выборка по индексу (recipe, rank).
+        """
+        recipes = list(
+            self.get_queryset()
+            .filter(similar_to__recipe_id=pk)
+            .order_by('similar_to__rank')
+        )
+        if not recipes:
+            get_object_or_404(Recipe, pk=pk)
+        return Response(self.get_serializer(recipes, many=True).data)
+
+    @action(detail=False, methods=['get'], url_path='by_ingredients',
+            pagination_class=LimitPageNumberPagination)
+    def by_ingredients(self, request):
+        """Рецепты, которые можно приготовить из имеющихся ингредиентов.
+
+        ?have=1,5,9 — id ингредиентов; с ?full=1 остаются только рецепты,
+        для которых хватает всех ингредиентов.
+        """
+        try:
+            ingredient_ids = [
+                int(pk) for pk in request.query_params.get('have', '').split(
+                    ',') if pk.strip()
+            ]
+        except ValueError:
+            ingredient_ids = []
+        if not ingredient_ids:
+            return Response(
+                {'have': 'Укажите id ингредиентов через запятую.'},
+                status=status.HTTP_400_BAD_REQUEST)
+        full = request.query_params.get('full') in ('1', 'true')
+        page = self.paginate_queryset(
+            recipe_ingredient_index.search(ingredient_ids, full=full))
+        recipes = self.get_queryset().in_bulk(
+            [recipe_id for recipe_id, _, _ in page])
+        page = [match for match in page if match[0] in recipes]
+        data = self.get_serializer(
+            [recipes[recipe_id] for recipe_id, _, _ in page], many=True).data
+        for item, (_, matched, total) in zip(data, page):
+            item['matched_ingredients'] = matched
+            item['missing_ingredients'] = total - matched
+        return self.get_paginated_response(data)
+
+    @action(detail=False, methods=['get'], url_path='download_shopping_cart',
+            permission_classes=[IsAuthenticated],
+            content_negotiation_class=IgnoreFormatContentNegotiation)
     def download_shopping_cart(self, request):
-        user = request.user
+        export_format = request.query_params.get('format', 'txt')
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {'errors': 'Доступные форматы: {}.'.format(
+                    ', '.join(EXPORT_FORMATS))},
+                status=status.HTTP_400_BAD_REQUEST)
         ingredients = (
-            RecipeIngredient.objects
-            .filter(recipe__shopping_cart__user=user)
-            .values(name=F('ingredient__name'), unit=F(
+            ShoppingListItem.objects
+            .filter(user=request.user)
+            .values('total', name=F('ingredient__name'), unit=F(
                 'ingredient__measurement_unit'))
-            .annotate(total=Sum('amount'))
             .order_by('name')
+            .iterator(chunk_size=settings.SHOPPING_LIST_CHUNK_SIZE)
         )
+        try:
+            return export_shopping_list(ingredients, export_format)
+        except ExportError as error:
+            return Response({'errors': str(error)},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
-        content = self.create_shopping_list(ingredients)
-        response = HttpResponse(content, content_type='text/plain')
-        response[
-            'Content-Disposition'] = 'attachment; filename="shopping_list.txt"'
-        return response
-
-    def create_shopping_list(self, ingredients):
-        return '\n'.join(
-            f"{item['name']} ({item['unit']}) {item['total']}"
-            for item in ingredients
-        )
 
-
-class TagViewSet(ReadOnlyModelViewSet):
+class TagViewSet(ConditionalGetMixin, ReadOnlyModelViewSet):
     queryset = Tag.objects
     serializer_class = TagSerializer
     pagination_class = None
     filter_backends = [filters.SearchFilter]
+    version_names = ('tags',)
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(ConditionalGetMixin, ReadOnlyModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     pagination_class = None
+    version_names = ('ingredients',)
+
+    def filter_queryset(self, queryset):
+        if self.action != 'list':
+            return super().filter_queryset(queryset)
+        # Версию уже прочитал ConditionalGetMixin для ETag.
+        version = self.versions['ingredients']
+        search = self.request.query_params.get('search')
+        if search:
+            if settings.INGREDIENT_INDEX_ENABLED:
+                return ingredient_index.search(
+                    search, settings.INGREDIENT_SEARCH_LIMIT, version)
+            return search_ingredients_in_db(
+                queryset, search, settings.INGREDIENT_SEARCH_LIMIT)
+        name = self.request.query_params.get('name')
+        if name and settings.INGREDIENT_INDEX_ENABLED:
+            return ingredient_index.search_prefix(name, version)
+        return super().filter_queryset(queryset)
 
     filter_backends = [DjangoFilterBackend]
     filterset_class = IngredientFilter
@@ -1,5 +1,6 @@
 from django.contrib.auth import get_user_model
-from django.db.models import Count
+from django.db import transaction
+from django.db.models import Value
 from django.shortcuts import get_object_or_404
 from djoser.views import UserViewSet as DjoserUserViewSet
 from rest_framework import status
@@ -12,6 +13,7 @@ from rest_framework.permissions import (
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from api.paginations import SubscriptionPagination
 from api.serializers.recipes import SubscriptionSerializer
 from api.serializers.users import (
     AvatarSerializer,
@@ -28,12 +30,17 @@ class UserAvatarAPIView(APIView):
     def put(self, request):
         serializer = AvatarSerializer(request.user, data=request.data)
         serializer.is_valid(raise_exception=True)
-        serializer.save()
+        # Блокировка файла, взятая хранилищем, держится до фиксации
+        # ссылки на него.
+        with transaction.atomic():
+            serializer.save()
         return Response(serializer.data, status=status.HTTP_200_OK)
 
     def delete(self, request):
+        # Файл удаляется сигналом, когда на него не остаётся ссылок.
         user = request.user
-        user.avatar.delete(save=True)
+        user.avatar = None
+        user.save(update_fields=['avatar'])
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
@@ -55,11 +62,12 @@ class CustomUserViewSet(DjoserUserViewSet):
         return super().me(request, *args, **kwargs)
 
     @action(detail=False, methods=['get'],
-            permission_classes=[IsAuthenticated])
+            permission_classes=[IsAuthenticated],
+            pagination_class=SubscriptionPagination)
     def subscriptions(self, request):
         queryset = User.objects.filter(
             subscribers__user=request.user).annotate(
-                recipes_count=Count('recipes'))
+                is_subscribed=Value(True))
 
         page = self.paginate_queryset(queryset)
         if page is not None:
@@ -1,6 +1,7 @@
 #!/bin/bash
 set -e
 python manage.py migrate
+python manage.py load_ingredients --no-update
 python manage.py collectstatic --noinput
 cp -r /app/collected_static/. /backend_static/
 exec "$@"
\ No newline at end of file
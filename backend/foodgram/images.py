@@ -0,0 +1,131 @@
+"""Уменьшенные копии загруженных изображений.
+
+Копии строятся в фоновом пуле потоков после сохранения модели
+и складываются в отдельный для каждого оригинала каталог внутри
+derivatives/. Загрузки туда не попадают, поэтому копия не совпадёт
+по имени ни с одной загрузкой.
+"""
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connection
+from PIL import Image, ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+PIL_FORMATS = {'webp': 'WEBP', 'jpeg': 'JPEG'}
+DERIVATIVES_DIR = 'derivatives'
+
+image_executor = None
+
+
+def get_image_executor():
+    global image_executor
+    if image_executor is None:
+        image_executor = ThreadPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            thread_name_prefix='images',
+        )
+    return image_executor
+
+
+def run_in_background(func, *args):
+    """Выполнить задачу в пуле; ошибки пишутся в лог."""
+    def run():
+        try:
+            func(*args)
+        except Exception:
+            logger.exception('Не удалось обработать изображение')
+        finally:
+            connection.close()
+    return get_image_executor().submit(run)
+
+
+def convert_for(image, image_format):
+    if image_format == 'jpeg':
+        if image.mode in ('RGBA', 'LA', 'P'):
+            image = image.convert('RGBA')
+            background = Image.new('RGB', image.size, 'white')
+            background.paste(image, mask=image.getchannel('A'))
+            return background
+        return image.convert('RGB')
+    if image.mode not in ('RGB', 'RGBA'):
+        return image.convert('RGBA')
+    return image
+
+
+def open_image(image):
+    with image.storage.open(image.name) as file:
+        source = Image.open(file)
+        source.load()
+    return ImageOps.exif_transpose(source)
+
+
+def save_image(storage, image, name, image_format):
+    """Сохранить картинку в хранилище; возвращает итоговое имя файла."""
+    buffer = io.BytesIO()
+    convert_for(image, image_format).save(
+        buffer, PIL_FORMATS[image_format],
+        quality=settings.IMAGE_DERIVATIVE_QUALITY,
+    )
+    return storage.save(
+        f'{name}.{image_format}', ContentFile(buffer.getvalue()))
+
+
+def get_derivative_base(name, label):
+    """Основа имени копии: recipes/a1b2.png -> recipes/derivatives/a1b2/…"""
+    directory, filename = os.path.split(name)
+    return os.path.join(
+        directory, DERIVATIVES_DIR, os.path.splitext(filename)[0], label)
+
+
+def render_derivatives(image, sizes):
+    """Сохранить уменьшенные копии изображения.
+
+    ``sizes`` — словарь «метка: ширина». Копии шире оригинала не
+    создаются. Возвращает описание копий для JSON-поля модели.
+    """
+    source = open_image(image)
+    formats = {name: [] for name in settings.IMAGE_DERIVATIVE_FORMATS}
+    widths = set()
+    for label, width in sorted(sizes.items(), key=lambda item: item[1]):
+        width = min(width, source.width)
+        if width in widths:
+            continue
+        widths.add(width)
+        height = max(round(source.height * width / source.width), 1)
+        resized = source.resize((width, height), Image.LANCZOS)
+        for name, variants in formats.items():
+            saved = save_image(
+                image.storage, resized,
+                get_derivative_base(image.name, label), name)
+            variants.append({'name': saved, 'width': width})
+    return {'source': image.name, 'formats': formats}
+
+
+def render_square_variants(image, sizes):
+    """Сохранить квадратные копии изображения со стороной из ``sizes``.
+
+    Возвращает описание копий для JSON-поля модели.
+    """
+    source = open_image(image)
+    variants = {}
+    for size in sizes:
+        square = ImageOps.fit(source, (size, size), Image.LANCZOS)
+        variants[str(size)] = save_image(
+            image.storage, square, get_derivative_base(image.name, str(size)),
+            settings.AVATAR_VARIANT_FORMAT)
+    return {'source': image.name, 'sizes': variants}
+
+
+def get_derivative_names(derivatives):
+    return {
+        variant['name']
+        for variants in derivatives.get('formats', {}).values()
+        for variant in variants
+    }
@@ -23,6 +23,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'rest_framework.authtoken',
     'djoser',
@@ -78,6 +79,65 @@ DATABASES = {
 }
 
 
+# Закешированные данные лежат в памяти процесса; версии наборов данных,
+# входящие в их ключи, хранятся в таблице DataVersion (см. api.cache),
+# поэтому устаревшие записи просто перестают находиться.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'foodgram',
+        'OPTIONS': {'MAX_ENTRIES': 10000},
+    },
+}
+
+RECIPE_FRAGMENT_TIMEOUT = 60 * 60
+
+INGREDIENT_INDEX_ENABLED = (
+    os.getenv('INGREDIENT_INDEX_ENABLED', 'True') == 'True')
+
+INGREDIENT_SEARCH_LIMIT = 20
+
+# С какого числа подписок лента пользователя хранится готовой
+# и пополняется при публикации рецептов, а не собирается при чтении.
+FEED_FANOUT_ON_WRITE_THRESHOLD = 50
+FEED_BACKFILL_SIZE = 100
+
+# Сколько рецептов можно добавить в избранное или корзину одним запросом.
+BULK_RECIPES_LIMIT = 100
+
+# Уменьшенные копии изображений рецептов: метка и ширина в пикселях.
+RECIPE_IMAGE_SIZES = {'card': 480, 'detail': 960, 'retina': 1920}
+IMAGE_DERIVATIVE_FORMATS = ('webp', 'jpeg')
+IMAGE_DERIVATIVE_QUALITY = 80
+IMAGE_WORKERS = int(os.getenv('IMAGE_WORKERS', 2))
+
+# Квадратные копии аватаров; в рецептах и подписках отдаётся маленькая.
+AVATAR_SIZES = (64, 128, 256)
+AVATAR_THUMBNAIL_SIZE = 64
+AVATAR_VARIANT_FORMAT = 'webp'
+
+# Похожие рецепты: сколько хранить на рецепт и веса частей вектора.
+# Вес избранного по умолчанию нулевой — совместные добавления в избранное
+# учитываются, только если задать его явно.
+SIMILAR_RECIPES_COUNT = 10
+SIMILAR_RECIPES_WEIGHTS = {'ingredients': 1.0, 'tags': 0.5, 'favorites': 0.0}
+
+# Рейтинги рецептов для ?ordering=popular и ?ordering=trending.
+# Вклад добавления в «популярное сейчас» уменьшается вдвое за период
+# полураспада; добавления старше окна не учитываются.
+RECIPE_SCORE_WEIGHTS = {'favorites': 2.0, 'shopping_cart': 1.0}
+TRENDING_HALF_LIFE = 3 * 24 * 60 * 60
+TRENDING_WINDOW = 14 * 24 * 60 * 60
+
+SHOPPING_LIST_CHUNK_SIZE = 500
+SHOPPING_LIST_PDF_WORKERS = int(os.getenv('SHOPPING_LIST_PDF_WORKERS', 2))
+SHOPPING_LIST_PDF_TIMEOUT = 30
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -130,6 +190,23 @@ CSRF_TRUSTED_ORIGINS = [
     'https://foodgram67.work.gd',
 ]
 
+# Загруженные файлы сразу пишутся во временный файл, а не в память.
+FILE_UPLOAD_HANDLERS = [
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+
+IMAGE_UPLOAD_MAX_SIZE = 10 * 2 ** 20
+IMAGE_UPLOAD_MAX_PIXELS = 40 * 10 ** 6
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'foodgram.storage.ContentAddressedStorage',
+    },
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage',
+    },
+}
+
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
@@ -0,0 +1,88 @@
+"""Хранилище медиафайлов с именами по хешу содержимого.
+
+Одинаковые загрузки сохраняются один раз, а содержимое файла по
+заданному URL никогда не меняется, поэтому /media/ можно отдавать
+с бессрочным кешированием. Файлы удаляются, когда на них не остаётся
+ссылок.
+
+Сохранение и удаление берут блокировку по имени файла до конца
+транзакции: загрузка, которая застала файл на месте и не стала его
+записывать, не разминётся с удалением этого файла.
+"""
+import hashlib
+import os
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+from django.db import connection, transaction
+
+
+def lock_names(names):
+    """Заблокировать имена файлов до конца текущей транзакции."""
+    if connection.vendor != 'postgresql' or not connection.in_atomic_block:
+        return
+    with connection.cursor() as cursor:
+        # Единый порядок захвата исключает взаимные блокировки.
+        for name in sorted(set(names)):
+            cursor.execute(
+                'SELECT pg_advisory_xact_lock(hashtext(%s))', [name])
+
+
+class ContentAddressedStorage(FileSystemStorage):
+    def get_hashed_name(self, name, content):
+        digest = hashlib.sha256()
+        content.seek(0)
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+        directory = os.path.dirname(name)
+        extension = os.path.splitext(name)[1].lower()
+        return os.path.join(directory, digest.hexdigest() + extension)
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+        if not hasattr(content, 'chunks'):
+            content = File(content, name)
+        name = self.get_hashed_name(name, content)
+        lock_names([name])
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length=max_length)
+
+
+def delete_unreferenced(model, field_name, name, derivatives=()):
+    """Удалить файл и его копии, если на файл не ссылается ни одна запись.
+
+    Возвращает True, если файл удалён.
+    """
+    if not name:
+        return False
+    with transaction.atomic():
+        lock_names([name])
+        if model._default_manager.filter(**{field_name: name}).exists():
+            return False
+        delete_files(model, field_name, [name, *derivatives])
+    return True
+
+
+def delete_files(model, field_name, names):
+    """Удалить файлы, которые не служат оригиналом ни одной записи.
+
+    Копии раньше лежали рядом с загрузками, и загрузка с тем же
+    содержимым получала то же имя, поэтому ссылки проверяются для
+    каждого файла.
+    """
+    names = set(filter(None, names))
+    if not names:
+        return
+    with transaction.atomic():
+        lock_names(names)
+        referenced = set(
+            model._default_manager
+            .filter(**{f'{field_name}__in': names})
+            .values_list(field_name, flat=True)
+        )
+        storage = model._meta.get_field(field_name).storage
+        for name in names - referenced:
+            storage.delete(name)
@@ -6,8 +6,10 @@ from .models import (
     Recipe,
     RecipeIngredient,
     ShoppingCart,
+    ShoppingListItem,
     Tag,
 )
+from .signals import recipe_ingredients_changed
 
 
 @admin.register(Ingredient)
@@ -47,12 +49,19 @@ class RecipeAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         queryset = super().get_queryset(request)
         return queryset.select_related('author').prefetch_related(
-            'tags', 'ingredients', 'favorited_by'
+            'tags', 'ingredients'
         )
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if change:
+            recipe_ingredients_changed.send(
+                sender=Recipe, recipe=form.instance)
+
     def get_favorites_count(self, obj):
-        return obj.favorited_by.count()
+        return obj.favorites_count
     get_favorites_count.short_description = 'В избранном'
+    get_favorites_count.admin_order_field = 'favorites_count'
 
 
 @admin.register(ShoppingCart)
@@ -78,3 +87,15 @@ class FavoriteAdmin(admin.ModelAdmin):
     def get_queryset(self, request):
         queryset = super().get_queryset(request)
         return queryset.select_related('user', 'recipe')
+
+
+@admin.register(ShoppingListItem)
+class ShoppingListItemAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'ingredient', 'total')
+    list_display_links = ['id', 'user']
+    list_filter = ('user',)
+    readonly_fields = ('user', 'ingredient', 'total')
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        return queryset.select_related('user', 'ingredient')
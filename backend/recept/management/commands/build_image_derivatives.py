@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from recept.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Строит уменьшенные копии изображений рецептов, где их нет.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Перестроить копии для всех рецептов.',
+        )
+
+    def handle(self, *args, **options):
+        built = 0
+        recipes = Recipe.objects.exclude(image='').only(
+            'id', 'image', 'image_derivatives')
+        for recipe in recipes.iterator():
+            if recipe.image_derivatives_ready and not options['force']:
+                continue
+            recipe.build_image_derivatives()
+            built += 1
+        self.stdout.write(f'Обработано рецептов: {built}')
@@ -0,0 +1,136 @@
+from itertools import islice
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from scipy import sparse
+
+from recept.models import Favorite, Recipe, RecipeIngredient, SimilarRecipe
+
+
+def build_matrix(pairs, recipe_ids):
+    """Разреженная матрица «рецепт × признак» из пар (recipe_id, признак).
+
+    Признаки взвешены по IDF, чтобы частые ингредиенты и теги (соль,
+    «завтрак») меньше влияли на сходство; строки нормированы.
+    """
+    pairs = np.fromiter(
+        (value for pair in pairs for value in pair), dtype=np.int64,
+    ).reshape(-1, 2)
+    rows = np.searchsorted(recipe_ids, pairs[:, 0])
+    known = (rows < len(recipe_ids)) & (
+        recipe_ids[np.minimum(rows, len(recipe_ids) - 1)] == pairs[:, 0])
+    features, columns = np.unique(pairs[known, 1], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(columns)), (rows[known], columns)),
+        shape=(len(recipe_ids), len(features)),
+    )
+    matrix.data[:] = 1
+    frequency = np.bincount(matrix.indices, minlength=len(features))
+    idf = np.log((1 + len(recipe_ids)) / (1 + frequency)) + 1
+    return normalize_rows(matrix @ sparse.diags(idf))
+
+
+def normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1
+    return sparse.csr_matrix(sparse.diags(1 / norms) @ matrix)
+
+
+def top_similar(vectors, recipe_ids, count, batch_size):
+    """Для каждого рецепта — ``count`` самых похожих по косинусу.
+
+    Сходство считается блоками строк разреженным умножением, поэтому
+    полная матрица «рецепт × рецепт» в памяти не строится.
+    """
+    transposed = vectors.T.tocsc()
+    for start in range(0, vectors.shape[0], batch_size):
+        block = (vectors[start:start + batch_size] @ transposed).tocsr()
+        for offset in range(block.shape[0]):
+            begin, end = block.indptr[offset], block.indptr[offset + 1]
+            scores = block.data[begin:end]
+            columns = block.indices[begin:end]
+            other = (columns != start + offset) & (scores > 0)
+            scores, columns = scores[other], columns[other]
+            if len(scores) > count:
+                best = np.argpartition(-scores, count - 1)[:count]
+                scores, columns = scores[best], columns[best]
+            order = np.lexsort((recipe_ids[columns], -scores))
+            yield recipe_ids[start + offset], [
+                (recipe_ids[column], score)
+                for column, score in zip(columns[order], scores[order])
+            ]
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает таблицу похожих рецептов по тегам и ингредиентам.'
+
+    def add_arguments(self, parser):
+        weights = settings.SIMILAR_RECIPES_WEIGHTS
+        parser.add_argument(
+            '--count', type=int, default=settings.SIMILAR_RECIPES_COUNT,
+            help='Сколько похожих рецептов хранить для каждого.',
+        )
+        parser.add_argument(
+            '--tags-weight', type=float, default=weights['tags'],
+            help='Вес тегов относительно ингредиентов.',
+        )
+        parser.add_argument(
+            '--favorites-weight', type=float, default=weights['favorites'],
+            help='Вес совместных добавлений в избранное; 0 — не учитывать.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько рецептов сравнивать за один проход.',
+        )
+
+    def handle(self, *args, **options):
+        recipe_ids = np.fromiter(
+            Recipe.objects.order_by('pk').values_list('pk', flat=True),
+            dtype=np.int64,
+        )
+        blocks = [
+            (settings.SIMILAR_RECIPES_WEIGHTS['ingredients'],
+             RecipeIngredient.objects.values_list(
+                 'recipe_id', 'ingredient_id')),
+            (options['tags_weight'],
+             Recipe.tags.through.objects.values_list('recipe_id', 'tag_id')),
+            (options['favorites_weight'],
+             Favorite.objects.values_list('recipe_id', 'user_id')),
+        ]
+        matrices = []
+        if len(recipe_ids) > 1:
+            matrices = [
+                weight * build_matrix(pairs.iterator(), recipe_ids)
+                for weight, pairs in blocks if weight > 0
+            ]
+        matrices = [matrix for matrix in matrices if matrix.shape[1]]
+        rows = []
+        if matrices:
+            vectors = normalize_rows(sparse.hstack(matrices, format='csr'))
+            rows = (
+                SimilarRecipe(
+                    recipe_id=int(recipe_id), similar_id=int(similar_id),
+                    score=float(score), rank=rank,
+                )
+                for recipe_id, similar in top_similar(
+                    vectors, recipe_ids, options['count'],
+                    options['batch_size'])
+                for rank, (similar_id, score) in enumerate(similar, 1)
+            )
+        rows = iter(rows)
+        created = 0
+        with transaction.atomic():
+            SimilarRecipe.objects.all().delete()
+            while batch := list(islice(rows, options['batch_size'])):
+                SimilarRecipe.objects.bulk_create(batch)
+                created += len(batch)
+            # Рецепты, удалённые во время расчёта, убираем из таблицы.
+            SimilarRecipe.objects.exclude(
+                recipe__in=Recipe.objects.all(),
+                similar__in=Recipe.objects.all(),
+            ).delete()
+        self.stdout.write(
+            f'Рецептов: {len(recipe_ids)}, '
+            f'записано похожих: {created}')
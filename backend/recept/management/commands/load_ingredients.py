@@ -0,0 +1,214 @@
+import csv
+import io
+import json
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from recept.constants import MAX_NAME_LENGTH
+from recept.models import Ingredient
+from recept.signals import ingredients_loaded
+
+
+FORMATS = ('csv', 'json')
+STAGING_TABLE = 'ingredient_staging'
+
+
+def iter_json_array(file, chunk_size=64 * 1024):
+    """Элементы JSON-массива по одному, без чтения файла целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    started = False
+    while True:
+        chunk = file.read(chunk_size)
+        buffer += chunk
+        while True:
+            buffer = buffer.lstrip()
+            if not buffer:
+                break
+            if not started:
+                if buffer[0] != '[':
+                    raise CommandError('Ожидался JSON-массив.')
+                buffer = buffer[1:]
+                started = True
+                continue
+            if buffer[0] == ',':
+                buffer = buffer[1:]
+                continue
+            if buffer[0] == ']':
+                return
+            try:
+                item, end = decoder.raw_decode(buffer)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise CommandError('Некорректный JSON.')
+                break
+            yield item
+            buffer = buffer[end:]
+        if not chunk:
+            raise CommandError('Некорректный JSON: массив не закрыт.')
+
+
+def read_rows(path, file_format):
+    """Пары (название, единица измерения) из CSV или JSON.
+
+    CSV — строки «название,единица» (заголовок необязателен), JSON —
+    массив объектов с полями name и measurement_unit или фикстура Django.
+    """
+    with open(path, encoding='utf-8', newline='') as file:
+        if file_format == 'csv':
+            for row in csv.reader(file):
+                if row[:2] != ['name', 'measurement_unit']:
+                    yield row
+            return
+        for item in iter_json_array(file):
+            fields = item.get('fields', item) if isinstance(
+                item, dict) else {}
+            yield fields.get('name'), fields.get('measurement_unit')
+
+
+class RowStream:
+    """Файлоподобный объект для copy_expert: строки CSV по мере чтения."""
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def read(self, size=-1):
+        while size < 0 or self.buffer.tell() < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.writer.writerow(row)
+        data = self.buffer.getvalue()
+        if size < 0:
+            size = len(data)
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        self.buffer.write(data[size:])
+        return data[:size]
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из CSV или JSON; существующие обновляются '
+        'по названию.')
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=settings.BASE_DIR / 'ingredients.json',
+            help='Файл с ингредиентами (по умолчанию ingredients.json).',
+        )
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help='Формат файла; по умолчанию определяется по расширению.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Размер пакета для bulk_create вне PostgreSQL.',
+        )
+        parser.add_argument(
+            '--no-update', action='store_false', dest='update',
+            help=(
+                'Только добавлять новые ингредиенты, не меняя единицы '
+                'измерения существующих (например, исправленные в админке).'),
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in FORMATS:
+            raise CommandError(
+                'Не удалось определить формат файла, укажите --format.')
+        if not path.is_file():
+            raise CommandError(f'Файл {path} не найден.')
+        self.rows_read = self.skipped = 0
+        rows = self.clean(read_rows(path, file_format))
+        started = time.monotonic()
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                changed = self.copy(rows, options['update'])
+            else:
+                changed = self.bulk_create(
+                    rows, options['batch_size'], options['update'])
+        elapsed = max(time.monotonic() - started, 1e-6)
+        if changed:
+            ingredients_loaded.send(sender=Ingredient)
+        self.stdout.write(
+            f'Прочитано строк: {self.rows_read}, пропущено: {self.skipped}, '
+            f'добавлено или обновлено: {changed}; '
+            f'{elapsed:.2f} с, {self.rows_read / elapsed:.0f} строк/с')
+
+    def clean(self, rows):
+        for row in rows:
+            self.rows_read += 1
+            name, unit = (
+                (str(value or '').strip() for value in row[:2])
+                if len(row) >= 2 else ('', ''))
+            if not name or not unit or max(
+                    len(name), len(unit)) > MAX_NAME_LENGTH:
+                self.skipped += 1
+                continue
+            yield name, unit
+
+    def copy(self, rows, update):
+        """COPY во временную таблицу и слияние одним INSERT ... ON CONFLICT.
+
+        Строки, которые ничего не меняют, не перезаписываются, поэтому
+        повторная загрузка того же файла не создаёт лишних версий строк.
+        """
+        table = connection.ops.quote_name(Ingredient._meta.db_table)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TEMPORARY TABLE {STAGING_TABLE} '
+                '(name text, measurement_unit text) ON COMMIT DROP')
+            copy_sql = (
+                f'COPY {STAGING_TABLE} (name, measurement_unit) FROM STDIN')
+            raw = cursor.cursor
+            if hasattr(raw, 'copy'):
+                # psycopg 3.
+                with raw.copy(copy_sql) as copy:
+                    for row in rows:
+                        copy.write_row(row)
+            else:
+                raw.copy_expert(
+                    f'{copy_sql} WITH (FORMAT csv)', RowStream(rows))
+            on_conflict = (
+                'DO UPDATE SET measurement_unit = EXCLUDED.measurement_unit '
+                f'WHERE {table}.measurement_unit '
+                'IS DISTINCT FROM EXCLUDED.measurement_unit'
+                if update else 'DO NOTHING')
+            # Из повторов одного названия в файле берётся последний.
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                f'SELECT DISTINCT ON (name) name, measurement_unit '
+                f'FROM {STAGING_TABLE} ORDER BY name, ctid DESC '
+                f'ON CONFLICT (name) {on_conflict}')
+            return cursor.rowcount
+
+    def bulk_create(self, rows, batch_size, update):
+        changed = 0
+        batch = {}
+        for name, unit in rows:
+            batch[name] = unit
+            if len(batch) >= batch_size:
+                changed += self.save_batch(batch, update)
+                batch = {}
+        if batch:
+            changed += self.save_batch(batch, update)
+        return changed
+
+    def save_batch(self, batch, update):
+        options = (
+            {'update_conflicts': True, 'unique_fields': ['name'],
+             'update_fields': ['measurement_unit']}
+            if update else {'ignore_conflicts': True})
+        return len(Ingredient.objects.bulk_create(
+            [Ingredient(name=name, measurement_unit=unit)
+             for name, unit in batch.items()],
+            **options,
+        ))
@@ -0,0 +1,41 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from recept.models import ShoppingListItem
+
+
+User = get_user_model()
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает списки покупок пользователей по их корзинам.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько пользователей пересчитывать за один проход.',
+        )
+        parser.add_argument(
+            '--user', type=int, action='append', dest='users',
+            help='Пересчитать только указанных пользователей (id).',
+        )
+
+    def handle(self, *args, **options):
+        if options['users']:
+            ShoppingListItem.objects.rebuild(users=options['users'])
+            self.stdout.write(
+                f'Пересчитано пользователей: {len(options["users"])}')
+            return
+        rebuilt = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                User.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:options['batch_size']]
+            )
+            if not batch:
+                break
+            last_pk = batch[-1]
+            ShoppingListItem.objects.rebuild(users=batch)
+            rebuilt += len(batch)
+        self.stdout.write(f'Пересчитано пользователей: {rebuilt}')
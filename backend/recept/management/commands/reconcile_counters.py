@@ -0,0 +1,84 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db.models import Count, Exists, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from recept.models import Favorite, FeedItem, Recipe, ShoppingCart
+from users.models import Follow
+
+
+User = get_user_model()
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'subscribers_count', Follow, 'following'),
+    (User, 'subscriptions_count', Follow, 'user'),
+)
+
+
+def count_related(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')})
+            .order_by()
+            .values(field)
+            .annotate(total=Count('pk'))
+            .values('total')
+        ),
+        0,
+    )
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные счётчики и исправляет расхождения.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько строк проверять за один запрос.',
+        )
+
+    def handle(self, *args, **options):
+        for model, field, related_model, related_field in COUNTERS:
+            fixed = self.reconcile(
+                model, field, count_related(related_model, related_field),
+                options['batch_size'],
+            )
+            self.stdout.write(
+                f'{model._meta.model_name}.{field}: исправлено {fixed}')
+        # После исправления счётчика подписок пользователь мог перейти
+        # на готовую ленту, не получив её заполнения.
+        users = list(
+            User.objects.filter(
+                subscriptions_count__gte=(
+                    settings.FEED_FANOUT_ON_WRITE_THRESHOLD),
+            ).exclude(
+                Exists(FeedItem.objects.filter(user=OuterRef('pk'))),
+            ).values_list('pk', flat=True)
+        )
+        FeedItem.objects.backfill(users)
+        self.stdout.write(f'Заполнено лент: {len(users)}')
+
+    def reconcile(self, model, field, actual, batch_size):
+        fixed = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                model.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not batch:
+                return fixed
+            last_pk = batch[-1]
+            drifted = list(
+                model.objects.filter(pk__in=batch)
+                .annotate(actual=actual)
+                .exclude(**{field: F('actual')})
+                .values_list('pk', flat=True)
+            )
+            if drifted:
+                fixed += model.objects.filter(pk__in=drifted).update(
+                    **{field: actual})
@@ -0,0 +1,87 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db.models import F, Value
+from django.utils import timezone
+
+from recept.models import Favorite, Recipe, ShoppingCart
+from recept.signals import recipe_scores_updated
+
+
+def popularity():
+    weights = settings.RECIPE_SCORE_WEIGHTS
+    return (
+        F('favorites_count') * Value(weights['favorites'])
+        + F('in_carts_count') * Value(weights['shopping_cart'])
+    )
+
+
+def trending_scores(now):
+    """Сумма добавлений в избранное и корзину за окно с затуханием."""
+    weights = settings.RECIPE_SCORE_WEIGHTS
+    since = now - timedelta(seconds=settings.TRENDING_WINDOW)
+    scores = defaultdict(float)
+    for model, weight in (
+        (Favorite, weights['favorites']),
+        (ShoppingCart, weights['shopping_cart']),
+    ):
+        added = model.objects.filter(created_at__gte=since).values_list(
+            'recipe_id', 'created_at')
+        for recipe_id, created_at in added.iterator():
+            age = max((now - created_at).total_seconds(), 0)
+            scores[recipe_id] += weight * 0.5 ** (
+                age / settings.TRENDING_HALF_LIFE)
+    return scores
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает рейтинги рецептов для сортировки по популярности.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Сколько рецептов обновлять за один запрос.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        popular = self.update_popularity(batch_size)
+        trending = self.update_trending(batch_size)
+        recipe_scores_updated.send(sender=Recipe)
+        self.stdout.write(
+            f'Обновлено рейтингов: популярность {popular}, '
+            f'популярное сейчас {trending}')
+
+    def update_popularity(self, batch_size):
+        updated = 0
+        last_pk = 0
+        while True:
+            batch = list(
+                Recipe.objects.filter(pk__gt=last_pk).order_by('pk')
+                .values_list('pk', flat=True)[:batch_size]
+            )
+            if not batch:
+                return updated
+            last_pk = batch[-1]
+            updated += (
+                Recipe.objects.filter(pk__in=batch)
+                .exclude(popularity_score=popularity())
+                .update(popularity_score=popularity())
+            )
+
+    def update_trending(self, batch_size):
+        scores = trending_scores(timezone.now())
+        # Рецепты, выпавшие из окна, обнуляются.
+        trending = Recipe.objects.filter(trending_score__gt=0).values_list(
+            'pk', flat=True)
+        for pk in trending.iterator():
+            scores.setdefault(pk, 0)
+        Recipe.objects.bulk_update(
+            [Recipe(pk=pk, trending_score=score)
+             for pk, score in scores.items()],
+            ['trending_score'],
+            batch_size=batch_size,
+        )
+        return len(scores)
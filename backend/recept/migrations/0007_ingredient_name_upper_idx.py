@@ -0,0 +1,30 @@
+# Generated by Django 4.2 on 2026-10-18 06:10
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+import django.db.models.functions.comparison
+import django.db.models.functions.text
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recept", "0006_alter_tag_options"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="ingredient",
+            index=models.Index(
+                django.contrib.postgres.indexes.OpClass(
+                    django.db.models.functions.text.Upper(
+                        django.db.models.functions.comparison.Cast(
+                            "name", models.TextField()
+                        )
+                    ),
+                    name="text_pattern_ops",
+                ),
+                name="ingredient_name_upper_idx",
+            ),
+        ),
+    ]
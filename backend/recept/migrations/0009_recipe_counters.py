@@ -0,0 +1,60 @@
+# Generated by Django 4.2 on 2026-10-18 06:15
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_related(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef("pk")})
+            .order_by()
+            .values(field)
+            .annotate(total=Count("pk"))
+            .values("total")
+        ),
+        0,
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model("recept", "Recipe")
+    Favorite = apps.get_model("recept", "Favorite")
+    ShoppingCart = apps.get_model("recept", "ShoppingCart")
+    User = apps.get_model("users", "User")
+    Follow = apps.get_model("users", "Follow")
+    Recipe.objects.update(
+        favorites_count=count_related(Favorite, "recipe"),
+        in_carts_count=count_related(ShoppingCart, "recipe"),
+    )
+    User.objects.update(
+        recipes_count=count_related(Recipe, "author"),
+        subscribers_count=count_related(Follow, "following"),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recept", "0008_ingredient_name_trgm_idx"),
+        ("users", "0006_user_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="favorites_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="В избранном"
+            ),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="in_carts_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="В списках покупок"
+            ),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
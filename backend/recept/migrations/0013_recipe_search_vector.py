@@ -0,0 +1,54 @@
+# Generated by Django 4.2 on 2026-10-18 06:31
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_VECTOR = """
+    setweight(to_tsvector('russian', coalesce({row}name, '')), 'A')
+    || setweight(to_tsvector('russian', coalesce({row}text, '')), 'B')
+"""
+
+CREATE_TRIGGER = f"""
+CREATE FUNCTION recept_recipe_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {SEARCH_VECTOR.format(row='NEW.')};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER recept_recipe_search_vector_trigger
+BEFORE INSERT OR UPDATE OF name, text ON recept_recipe
+FOR EACH ROW EXECUTE FUNCTION recept_recipe_search_vector_update();
+
+UPDATE recept_recipe SET search_vector = {SEARCH_VECTOR.format(row='')};
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS recept_recipe_search_vector_trigger ON recept_recipe;
+DROP FUNCTION IF EXISTS recept_recipe_search_vector_update();
+"""
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recept", "0012_recipe_image_derivatives"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="recipe",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                editable=False, null=True, verbose_name="Поисковый вектор"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=django.contrib.postgres.indexes.GinIndex(
+                fields=["search_vector"], name="recipe_search_idx"
+            ),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+    ]
@@ -0,0 +1,60 @@
+# Generated by Django 4.2 on 2026-10-18 06:36
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("recept", "0014_similarrecipe"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="favorite",
+            name="created_at",
+            field=models.DateTimeField(
+                db_index=True,
+                default=django.utils.timezone.now,
+                verbose_name="Добавлено",
+            ),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="popularity_score",
+            field=models.FloatField(
+                default=0, editable=False, verbose_name="Популярность"
+            ),
+        ),
+        migrations.AddField(
+            model_name="recipe",
+            name="trending_score",
+            field=models.FloatField(
+                default=0,
+                editable=False,
+                verbose_name="Популярность за последнее время",
+            ),
+        ),
+        migrations.AddField(
+            model_name="shoppingcart",
+            name="created_at",
+            field=models.DateTimeField(
+                db_index=True,
+                default=django.utils.timezone.now,
+                verbose_name="Добавлено",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(
+                fields=["-popularity_score", "-id"], name="recipe_popularity_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="recipe",
+            index=models.Index(
+                fields=["-trending_score", "-id"], name="recipe_trending_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.conf import settings
+from django.db import migrations
+from django.db.models import Count
+
+
+def backfill_feeds(apps, schema_editor):
+    # Пользователи, у которых подписок уже больше порога, сразу читают
+    # готовую ленту; без заполнения она была бы пустой до новых рецептов.
+    Follow = apps.get_model("users", "Follow")
+    Recipe = apps.get_model("recept", "Recipe")
+    FeedItem = apps.get_model("recept", "FeedItem")
+    user_ids = (
+        Follow.objects.values("user_id")
+        .annotate(follows=Count("pk"))
+        .filter(follows__gte=settings.FEED_FANOUT_ON_WRITE_THRESHOLD)
+        .values_list("user_id", flat=True)
+    )
+    for user_id in user_ids:
+        recipe_ids = (
+            Recipe.objects.filter(author__subscribers__user_id=user_id)
+            .order_by("-id")
+            .values_list("pk", flat=True)[: settings.FEED_BACKFILL_SIZE]
+        )
+        FeedItem.objects.bulk_create(
+            [FeedItem(user_id=user_id, recipe_id=pk) for pk in recipe_ids],
+            ignore_conflicts=True,
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0007_user_subscriptions_count"),
+        ("recept", "0015_recipe_scores"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_feeds, migrations.RunPython.noop),
+    ]
@@ -1,6 +1,15 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Cast, Greatest, Upper
+from django.utils import timezone
+
+from foodgram.images import get_derivative_names, render_derivatives
+from foodgram.storage import delete_files
 
 from .constants import MAX_LENGTH_TAGS, MAX_NAME_LENGTH
 
@@ -49,6 +58,18 @@ class Ingredient(models.Model):
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
         ordering = ('name',)
+        indexes = [
+            # Поиск name__istartswith строится как
+            # UPPER(name::text) LIKE UPPER('...%'), обычный уникальный
+            # индекс по name для него не подходит.
+            models.Index(
+                OpClass(
+                    Upper(Cast('name', models.TextField())),
+                    name='text_pattern_ops',
+                ),
+                name='ingredient_name_upper_idx',
+            ),
+        ]
 
     def __str__(self):
         return f'{self.name} ({self.measurement_unit})'
@@ -71,6 +92,12 @@ class Recipe(models.Model):
         upload_to='recipes',
         verbose_name='Изображение',
     )
+    image_derivatives = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии изображения',
+    )
     text = models.TextField(
         verbose_name='Описание рецепта',
     )
@@ -89,15 +116,75 @@ class Recipe(models.Model):
         validators=[MinValueValidator(1)],
         verbose_name='Время приготовления (в минутах)',
     )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном',
+    )
+    in_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок',
+    )
+    # Пересчитываются командой update_recipe_scores.
+    popularity_score = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name='Популярность',
+    )
+    trending_score = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name='Популярность за последнее время',
+    )
+    # Заполняется триггером базы данных по названию и описанию.
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+        verbose_name='Поисковый вектор',
+    )
 
     class Meta:
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-id',)
+        indexes = [
+            GinIndex(fields=['search_vector'], name='recipe_search_idx'),
+            models.Index(
+                fields=['-popularity_score', '-id'],
+                name='recipe_popularity_idx',
+            ),
+            models.Index(
+                fields=['-trending_score', '-id'],
+                name='recipe_trending_idx',
+            ),
+        ]
 
     def __str__(self):
         return self.name
 
+    @property
+    def image_derivatives_ready(self):
+        return bool(self.image) and (
+            self.image_derivatives.get('source') == self.image.name)
+
+    def build_image_derivatives(self):
+        """Построить уменьшенные копии изображения.
+
+        Копии прежнего изображения удаляются вместе с ним, когда на него
+        не остаётся ссылок; здесь убираются только устаревшие копии того
+        же изображения.
+        """
+        previous = self.image_derivatives
+        self.image_derivatives = render_derivatives(
+            self.image, settings.RECIPE_IMAGE_SIZES)
+        self.save(update_fields=['image_derivatives'])
+        if previous.get('source') == self.image.name:
+            delete_files(
+                Recipe, 'image',
+                get_derivative_names(previous)
+                - get_derivative_names(self.image_derivatives))
+
 
 class RecipeIngredient(models.Model):
     """Связь рецепта и ингредиента с указанием количества."""
@@ -125,6 +212,8 @@ class RecipeIngredient(models.Model):
 
 
 class ShoppingCart(models.Model):
+    recipe_counter = 'in_carts_count'
+
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -137,6 +226,11 @@ class ShoppingCart(models.Model):
         related_name='shopping_cart',
         verbose_name='Рецепт',
     )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        db_index=True,
+        verbose_name='Добавлено',
+    )
 
     class Meta:
         verbose_name = 'Корзина покупок'
@@ -152,6 +246,8 @@ class ShoppingCart(models.Model):
 
 
 class Favorite(models.Model):
+    recipe_counter = 'favorites_count'
+
     user = models.ForeignKey(
         User,
         on_delete=models.CASCADE,
@@ -164,6 +260,11 @@ class Favorite(models.Model):
         related_name='favorited_by',
         verbose_name='Рецепт',
     )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        db_index=True,
+        verbose_name='Добавлено',
+    )
 
     class Meta:
         verbose_name = 'Избранное'
@@ -176,3 +277,219 @@ class Favorite(models.Model):
 
     def __str__(self):
         return f'Избранное пользователя {self.user} - рецепт {self.recipe}'
+
+
+class FeedItemQuerySet(models.QuerySet):
+    def backfill(self, user_ids):
+        """Заполнить ленты последними рецептами авторов из подписок.
+
+        Уже записанные рецепты пропускаются, поэтому вызов можно
+        повторять.
+        """
+        for user_id in user_ids:
+            recipe_ids = Recipe.objects.filter(
+                author__subscribers__user_id=user_id,
+            ).order_by('-id').values_list('pk', flat=True)[
+                :settings.FEED_BACKFILL_SIZE]
+            self.bulk_create(
+                [self.model(user_id=user_id, recipe_id=pk)
+                 for pk in recipe_ids],
+                ignore_conflicts=True,
+            )
+
+
+class FeedItem(models.Model):
+    """Рецепт в ленте подписчика, записанный при публикации."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_items',
+        verbose_name='Рецепт',
+    )
+
+    objects = FeedItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'], name='unique_feed_item'
+            )
+        ]
+
+    def __str__(self):
+        return f'Лента пользователя {self.user} - рецепт {self.recipe}'
+
+
+class SimilarRecipe(models.Model):
+    """Похожий рецепт; таблица пересчитывается командой
+    build_similar_recipes."""
+
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_links',
+        verbose_name='Рецепт',
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='similar_to',
+        verbose_name='Похожий рецепт',
+    )
+    score = models.FloatField(verbose_name='Сходство')
+    rank = models.PositiveSmallIntegerField(verbose_name='Место')
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['recipe', 'rank'], name='unique_similar_recipe_rank'
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} ~ {self.similar} ({self.score:.2f})'
+
+
+def recipes_amount(recipe_ids):
+    """Суммарное количество ингредиента строки списка покупок в рецептах."""
+    return Subquery(
+        RecipeIngredient.objects.filter(
+            recipe_id__in=recipe_ids, ingredient_id=OuterRef('ingredient_id'))
+        .order_by()
+        .values('ingredient_id')
+        .annotate(total=Sum('amount'))
+        .values('total')
+    )
+
+
+class ShoppingListItemQuerySet(models.QuerySet):
+    def add_recipes(self, user_id, recipe_ids):
+        """Прибавить ингредиенты рецептов к списку покупок пользователя."""
+        ingredient_ids = list(
+            RecipeIngredient.objects.filter(recipe_id__in=recipe_ids)
+            .values_list('ingredient_id', flat=True)
+            .distinct()
+        )
+        if not ingredient_ids:
+            return
+        with transaction.atomic():
+            # Сначала создаём недостающие строки с нулём, затем прибавляем
+            # одним UPDATE: блокировка строк упорядочивает параллельные
+            # добавления в корзину.
+            self.bulk_create(
+                [ShoppingListItem(user_id=user_id, ingredient_id=pk, total=0)
+                 for pk in ingredient_ids],
+                ignore_conflicts=True,
+            )
+            self.filter(
+                user_id=user_id, ingredient_id__in=ingredient_ids
+            ).update(total=F('total') + recipes_amount(recipe_ids))
+
+    def remove_recipe(self, user_id, recipe_id):
+        """Вычесть ингредиенты рецепта из списка покупок пользователя."""
+        items = self.filter(
+            user_id=user_id,
+            ingredient_id__in=RecipeIngredient.objects.filter(
+                recipe_id=recipe_id).values('ingredient_id'),
+        )
+        with transaction.atomic():
+            items.update(total=Greatest(
+                F('total') - recipes_amount([recipe_id]), 0))
+            items.filter(total=0).delete()
+
+    def rebuild(self, users=None, ingredients=None):
+        """Пересчитать строки списков покупок по содержимому корзин.
+
+        Без аргументов пересчитываются все списки; ``users`` и
+        ``ingredients`` ограничивают пересчёт.
+        """
+        items = self.all()
+        conditions = {'recipe__ingredient_links__isnull': False}
+        if users is not None:
+            items = items.filter(user__in=users)
+            conditions['user__in'] = users
+        if ingredients is not None:
+            items = items.filter(ingredient__in=ingredients)
+            conditions['recipe__ingredient_links__ingredient__in'] = (
+                ingredients)
+        totals = (
+            ShoppingCart.objects.filter(**conditions)
+            .values(
+                'user_id',
+                ingredient_id=F('recipe__ingredient_links__ingredient'),
+            )
+            .annotate(total=Sum('recipe__ingredient_links__amount'))
+            .order_by()
+        )
+        with transaction.atomic():
+            items.delete()
+            self.bulk_create(
+                (ShoppingListItem(**row) for row in totals.iterator()),
+                batch_size=1000,
+            )
+
+
+class ShoppingListItem(models.Model):
+    """Суммарное количество ингредиента в корзине пользователя."""
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredient,
+        on_delete=models.CASCADE,
+        related_name='shopping_list_items',
+        verbose_name='Ингредиент',
+    )
+    total = models.PositiveIntegerField(verbose_name='Количество')
+
+    objects = ShoppingListItemQuerySet.as_manager()
+
+    class Meta:
+        verbose_name = 'Строка списка покупок'
+        verbose_name_plural = 'Списки покупок'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='unique_shopping_list_item',
+            )
+        ]
+
+    def __str__(self):
+        return f'{self.ingredient} - {self.total} ({self.user})'
+
+
+class DataVersion(models.Model):
+    """Версия набора данных, от которого зависят ответы API.
+
+    Значение — момент последнего изменения в наносекундах; таблица общая
+    для всех процессов, см. api.cache.
+    """
+
+    name = models.CharField(
+        max_length=MAX_NAME_LENGTH,
+        unique=True,
+        verbose_name='Набор данных',
+    )
+    value = models.BigIntegerField(verbose_name='Версия')
+
+    class Meta:
+        verbose_name = 'Версия данных'
+        verbose_name_plural = 'Версии данных'
+
+    def __str__(self):
+        return f'{self.name}={self.value}'
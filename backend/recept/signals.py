@@ -0,0 +1,211 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import (
+    post_delete,
+    post_save,
+    pre_delete,
+    pre_save,
+)
+from django.dispatch import Signal, receiver
+
+from foodgram.images import get_derivative_names, run_in_background
+from foodgram.storage import delete_unreferenced
+from users.models import Follow
+
+from .models import (
+    Favorite,
+    FeedItem,
+    Recipe,
+    ShoppingCart,
+    ShoppingListItem,
+    User,
+)
+
+
+# Отправляется после изменения состава ингредиентов рецепта.
+# Аргументы: recipe и ingredient_ids — затронутые ингредиенты
+# (None, если неизвестно какие).
+recipe_ingredients_changed = Signal()
+
+# Отправляется после пакетной вставки в избранное или корзину, для которой
+# post_save не вызывается. Аргументы: user_id и recipe_ids — добавленные
+# рецепты.
+recipes_added = Signal()
+
+# Отправляется командой update_recipe_scores после пересчёта рейтингов:
+# порядок рецептов в сортировках по популярности меняется без сохранения
+# моделей.
+recipe_scores_updated = Signal()
+
+# Отправляется командой load_ingredients, которая пишет ингредиенты
+# в обход моделей.
+ingredients_loaded = Signal()
+
+
+def change_counter(queryset, field, delta):
+    """Атомарно изменить счётчик, не опуская его ниже нуля."""
+    queryset.update(**{field: Greatest(F(field) + delta, 0)})
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def increment_recipe_counter(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(
+            Recipe.objects.filter(pk=instance.recipe_id),
+            sender.recipe_counter, 1)
+
+
+@receiver(recipes_added, sender=Favorite)
+@receiver(recipes_added, sender=ShoppingCart)
+def increment_recipe_counters(sender, user_id, recipe_ids, **kwargs):
+    change_counter(
+        Recipe.objects.filter(pk__in=recipe_ids), sender.recipe_counter, 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_recipe_counter(sender, instance, **kwargs):
+    change_counter(
+        Recipe.objects.filter(pk=instance.recipe_id),
+        sender.recipe_counter, -1)
+
+
+@receiver(post_save, sender=ShoppingCart)
+def add_to_shopping_list(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        ShoppingListItem.objects.add_recipes(
+            instance.user_id, [instance.recipe_id])
+
+
+@receiver(recipes_added, sender=ShoppingCart)
+def add_many_to_shopping_list(sender, user_id, recipe_ids, **kwargs):
+    ShoppingListItem.objects.add_recipes(user_id, recipe_ids)
+
+
+@receiver(pre_delete, sender=ShoppingCart)
+def remove_from_shopping_list(sender, instance, **kwargs):
+    # pre_delete: при каскадном удалении рецепта его ингредиенты
+    # ещё на месте.
+    ShoppingListItem.objects.remove_recipe(
+        instance.user_id, instance.recipe_id)
+
+
+@receiver(recipe_ingredients_changed, sender=Recipe)
+def refresh_shopping_lists(sender, recipe, ingredient_ids=None, **kwargs):
+    ShoppingListItem.objects.rebuild(
+        users=ShoppingCart.objects.filter(recipe=recipe).values('user_id'),
+        ingredients=ingredient_ids,
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        change_counter(
+            User.objects.filter(pk=instance.author_id), 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    change_counter(
+        User.objects.filter(pk=instance.author_id), 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def fan_out_recipe(sender, instance, created, raw=False, **kwargs):
+    """Записать новый рецепт в ленты подписчиков с большим числом подписок.
+
+    Ленты остальных пользователей собираются при чтении.
+    """
+    if not created or raw:
+        return
+    followers = User.objects.filter(
+        subscriptions__following_id=instance.author_id,
+        subscriptions_count__gte=settings.FEED_FANOUT_ON_WRITE_THRESHOLD,
+    ).values_list('pk', flat=True)
+    FeedItem.objects.bulk_create(
+        (FeedItem(user_id=pk, recipe=instance) for pk in followers),
+        batch_size=1000,
+        ignore_conflicts=True,
+    )
+
+
+@receiver(post_save, sender=Follow)
+def backfill_feed(sender, instance, created, raw=False, **kwargs):
+    if not created or raw:
+        return
+    follows = Follow.objects.filter(user_id=instance.user_id).count()
+    threshold = settings.FEED_FANOUT_ON_WRITE_THRESHOLD
+    if follows < threshold:
+        return
+    if follows == threshold:
+        # Пользователь только что перешёл на готовую ленту:
+        # заполняем её рецептами всех авторов, на которых он подписан.
+        FeedItem.objects.backfill([instance.user_id])
+        return
+    recipe_ids = Recipe.objects.filter(
+        author_id=instance.following_id,
+    ).order_by('-id').values_list('pk', flat=True)[
+        :settings.FEED_BACKFILL_SIZE]
+    FeedItem.objects.bulk_create(
+        [FeedItem(user_id=instance.user_id, recipe_id=pk)
+         for pk in recipe_ids],
+        ignore_conflicts=True,
+    )
+
+
+@receiver(post_delete, sender=Follow)
+def clear_feed(sender, instance, **kwargs):
+    FeedItem.objects.filter(
+        user_id=instance.user_id,
+        recipe__author_id=instance.following_id,
+    ).delete()
+
+
+def build_image_derivatives(recipe_id):
+    recipe = Recipe.objects.filter(pk=recipe_id).first()
+    if recipe is not None and recipe.image:
+        recipe.build_image_derivatives()
+
+
+@receiver(post_save, sender=Recipe)
+def schedule_image_derivatives(sender, instance, raw=False, **kwargs):
+    if raw or not instance.image or instance.image_derivatives_ready:
+        return
+    transaction.on_commit(
+        lambda: run_in_background(build_image_derivatives, instance.pk))
+
+
+def release_image(name, derivatives):
+    delete_unreferenced(
+        Recipe, 'image', name, get_derivative_names(derivatives))
+
+
+@receiver(pre_save, sender=Recipe)
+def remember_replaced_image(sender, instance, raw=False, update_fields=None,
+                            **kwargs):
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and 'image' not in update_fields:
+        return
+    previous = Recipe.objects.filter(pk=instance.pk).values(
+        'image', 'image_derivatives').first()
+    if previous and previous['image'] != instance.image.name:
+        instance._replaced_image = previous
+
+
+@receiver(post_save, sender=Recipe)
+def release_replaced_image(sender, instance, **kwargs):
+    previous = instance.__dict__.pop('_replaced_image', None)
+    if previous:
+        transaction.on_commit(lambda: release_image(
+            previous['image'], previous['image_derivatives']))
+
+
+@receiver(post_delete, sender=Recipe)
+def release_deleted_image(sender, instance, **kwargs):
+    transaction.on_commit(lambda: release_image(
+        instance.image.name, instance.image_derivatives))
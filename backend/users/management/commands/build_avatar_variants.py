@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = 'Строит копии аватаров пользователей, где их нет.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--force', action='store_true',
+            help='Перестроить копии для всех пользователей.',
+        )
+
+    def handle(self, *args, **options):
+        built = 0
+        users = User.objects.exclude(avatar='').only(
+            'id', 'avatar', 'avatar_variants')
+        for user in users.iterator():
+            if user.avatar_variants_ready and not options['force']:
+                continue
+            user.build_avatar_variants()
+            built += 1
+        self.stdout.write(f'Обработано пользователей: {built}')
@@ -0,0 +1,40 @@
+# Generated by Django 4.2 on 2026-10-18 06:17
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def fill_subscriptions_count(apps, schema_editor):
+    User = apps.get_model("users", "User")
+    Follow = apps.get_model("users", "Follow")
+    User.objects.update(
+        subscriptions_count=Coalesce(
+            Subquery(
+                Follow.objects.filter(user=OuterRef("pk"))
+                .order_by()
+                .values("user")
+                .annotate(total=Count("pk"))
+                .values("total")
+            ),
+            0,
+        )
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0006_user_counters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="subscriptions_count",
+            field=models.PositiveIntegerField(
+                default=0, editable=False, verbose_name="Количество подписок"
+            ),
+        ),
+        migrations.RunPython(fill_subscriptions_count, migrations.RunPython.noop),
+    ]
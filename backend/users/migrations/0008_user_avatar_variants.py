@@ -0,0 +1,20 @@
+# Generated by Django 4.2 on 2026-10-18 06:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("users", "0007_user_subscriptions_count"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="avatar_variants",
+            field=models.JSONField(
+                blank=True, default=dict, editable=False, verbose_name="Копии аватара"
+            ),
+        ),
+    ]
@@ -1,7 +1,10 @@
+from django.conf import settings
 from django.contrib.auth.models import AbstractUser
 from django.core.validators import MaxLengthValidator, RegexValidator
 from django.db import models
 
+from foodgram.images import render_square_variants
+
 from .constants import MAX_LENGTH_EMAIL, MAX_LENGTH_NAME
 from .validators import validate_username
 
@@ -57,6 +60,31 @@ class User(AbstractUser):
         verbose_name='Аватар',
     )
 
+    avatar_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Копии аватара',
+    )
+
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов',
+    )
+
+    subscribers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков',
+    )
+
+    subscriptions_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписок',
+    )
+
     class Meta:
         verbose_name = 'Пользователь'
         verbose_name_plural = 'Пользователи'
@@ -65,6 +93,23 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
+    @property
+    def avatar_variants_ready(self):
+        return bool(self.avatar) and (
+            self.avatar_variants.get('source') == self.avatar.name)
+
+    def get_avatar_name(self, size=None):
+        """Имя файла копии аватара нужного размера или оригинала."""
+        if size is not None and self.avatar_variants_ready:
+            return self.avatar_variants['sizes'].get(
+                str(size), self.avatar.name)
+        return self.avatar.name
+
+    def build_avatar_variants(self):
+        self.avatar_variants = render_square_variants(
+            self.avatar, settings.AVATAR_SIZES)
+        self.save(update_fields=['avatar_variants'])
+
 
 class Follow(models.Model):
     """Модель подписок."""""
@@ -0,0 +1,74 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.functions import Greatest
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import receiver
+
+from foodgram.images import run_in_background
+from foodgram.storage import delete_unreferenced
+
+from .models import Follow, User
+
+
+@receiver(post_save, sender=Follow)
+def increment_follow_counters(sender, instance, created, raw=False,
+                              **kwargs):
+    if created and not raw:
+        User.objects.filter(pk=instance.following_id).update(
+            subscribers_count=F('subscribers_count') + 1)
+        User.objects.filter(pk=instance.user_id).update(
+            subscriptions_count=F('subscriptions_count') + 1)
+
+
+@receiver(post_delete, sender=Follow)
+def decrement_follow_counters(sender, instance, **kwargs):
+    User.objects.filter(pk=instance.following_id).update(
+        subscribers_count=Greatest(F('subscribers_count') - 1, 0))
+    User.objects.filter(pk=instance.user_id).update(
+        subscriptions_count=Greatest(F('subscriptions_count') - 1, 0))
+
+
+def release_avatar(name, variants):
+    delete_unreferenced(
+        User, 'avatar', name, variants.get('sizes', {}).values())
+
+
+@receiver(pre_save, sender=User)
+def remember_replaced_avatar(sender, instance, raw=False, update_fields=None,
+                             **kwargs):
+    if raw or instance.pk is None:
+        return
+    if update_fields is not None and 'avatar' not in update_fields:
+        return
+    previous = User.objects.filter(pk=instance.pk).values(
+        'avatar', 'avatar_variants').first()
+    if previous and previous['avatar'] != instance.avatar.name:
+        instance._replaced_avatar = previous
+
+
+@receiver(post_save, sender=User)
+def release_replaced_avatar(sender, instance, **kwargs):
+    previous = instance.__dict__.pop('_replaced_avatar', None)
+    if previous and previous['avatar']:
+        transaction.on_commit(lambda: release_avatar(
+            previous['avatar'], previous['avatar_variants']))
+
+
+@receiver(post_delete, sender=User)
+def release_deleted_avatar(sender, instance, **kwargs):
+    transaction.on_commit(lambda: release_avatar(
+        instance.avatar.name, instance.avatar_variants))
+
+
+def build_avatar_variants(user_id):
+    user = User.objects.filter(pk=user_id).first()
+    if user is not None and user.avatar:
+        user.build_avatar_variants()
+
+
+@receiver(post_save, sender=User)
+def schedule_avatar_variants(sender, instance, raw=False, **kwargs):
+    if raw or not instance.avatar or instance.avatar_variants_ready:
+        return
+    transaction.on_commit(
+        lambda: run_in_background(build_avatar_variants, instance.pk))